@@ -0,0 +1,250 @@
+# an optional background process that keeps one vault unlocked and answers
+# lookups over a Unix domain socket, so scripts and the GUI can skip the KDF;
+# only the user that started it can connect, and it locks itself (wiping
+# the key and removing the socket) after idleTime seconds without a request
+#
+# every request and response is one line of JSON:
+#     {"command": "get", "db": "/path/entries.db", "title": "Gmail",
+#      "field": "password"}
+#     {"ok": true, "result": ["hunter2"]}
+# commands: ping, list (prefix), get (title, field), totp (title), key, lock
+import os
+import sys
+import json
+import stat
+import time
+import base64
+import socket
+import tempfile
+import socketserver
+import vault
+from totp import generateTOTP
+
+# the same default as app.idleTime in the GUI
+defaultIdleTime = 60
+socketVariable = 'STEELPASS_AGENT_SOCKET'
+fields = {'username': 2, 'password': 3, 'seed': 4}
+# the error for a request about a vault other than the agent's, which
+# clients answer by unlocking the vault themselves
+otherVaultError = 'The agent holds another vault.'
+
+# $STEELPASS_AGENT_SOCKET, or a socket in the user's runtime directory, or
+# in a private directory under the temp directory
+def getSocketPath():
+    if os.environ.get(socketVariable):
+        return os.environ[socketVariable]
+    directory = os.environ.get('XDG_RUNTIME_DIR') or getPrivateDirectory()
+    return os.path.join(directory, 'steelpass-agent.sock')
+
+def getPrivateDirectory():
+    return os.path.join(tempfile.gettempdir(), f'steelpass-{os.getuid()}')
+
+# anyone can make the private directory's name first in a shared temp
+# directory, so it is only used if it is really ours: a directory (not a
+# symlink to one) owned by this user that nobody else can get into
+def checkPrivateDirectory(directory):
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or \
+       stat.S_IMODE(info.st_mode) != 0o700:
+        raise OSError(f'{directory} is not a private directory of this '
+                      f'user; remove it or set ${socketVariable}.')
+
+# the uid of the process at the other end of a connection, or None where
+# the platform can't tell (SO_PEERCRED is Linux only)
+def getPeerUid(connection):
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return None
+    credentials = connection.getsockopt(socket.SOL_SOCKET,
+                                        socket.SO_PEERCRED, 12)
+    return int.from_bytes(credentials[4:8], sys.byteorder)
+
+# the same vault opened under another path must still match
+def getVaultPath(path):
+    return os.path.realpath(path)
+
+class AgentHandler(socketserver.StreamRequestHandler):
+    # a client that stops talking can't keep the agent from serving others
+    timeout = 5
+
+    def handle(self):
+        if not self.server.agent.isPeerAllowed(self.request):
+            return
+        for line in self.rfile:
+            if self.server.locked:
+                return
+            try:
+                message = json.loads(line)
+            except ValueError:
+                message = None
+            try:
+                if type(message) != dict:
+                    response = {'ok': False, 'error': 'Malformed request.'}
+                else:
+                    response = self.server.agent.handle(message)
+            except vault.StaleKeyError:
+                # the master password was changed by another process, so
+                # the key held here is of no use any more
+                self.server.agent.lock()
+                response = {'ok': False, 'error': 'The vault key changed; '
+                                                  'unlock again.'}
+            except vault.CorruptEntryError as error:
+                response = {'ok': False, 'error': f'The vault is damaged: '
+                                                  f'{error}.'}
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+class Agent:
+    def __init__(self, vaultKey, dbPath, socketPath=None,
+                 idleTime=defaultIdleTime):
+        self.vaultKey = vaultKey
+        self.dbPath = getVaultPath(dbPath)
+        self.socketPath = socketPath or getSocketPath()
+        self.idleTime = idleTime
+        self.lastRequest = time.monotonic()
+        # normalized title -> getSealedEntries entries with that title
+        self.titles = {}
+        # changes whenever another connection commits to the vault
+        self.dataVersion = None
+        self.server = None
+
+    # requests are answered from the sealed entries in memory; they are
+    # read again only after the vault changed
+    def refresh(self):
+        dataVersion = \
+            vault.store.execute('PRAGMA data_version').fetchone()[0]
+        if dataVersion == self.dataVersion:
+            return
+        titles = {}
+        for entry in vault.getSealedEntries(self.vaultKey):
+            titles.setdefault(vault.normalizeText(entry[1]), []).append(entry)
+        self.titles = titles
+        self.dataVersion = dataVersion
+
+    # (id, title, username, password, seed) of the entries with a title
+    def getEntries(self, title):
+        return [(entry[0], entry[1],
+                 *vault.openSealed(self.vaultKey, entry[2]))
+                for entry in self.titles.get(vault.normalizeText(title), [])]
+
+    # a ping only asks whether the agent is there (the GUI sends one every
+    # time it shows the unlock form), so it does not hold off the idle lock
+    def handle(self, request):
+        command = request.get('command')
+        if command == 'ping':
+            return {'ok': True, 'result': self.dbPath}
+        self.lastRequest = time.monotonic()
+        if self.vaultKey == None:
+            return {'ok': False, 'error': 'The agent is locked.'}
+        if getVaultPath(request.get('db', '')) != self.dbPath:
+            return {'ok': False, 'error': otherVaultError}
+        if command == 'lock':
+            self.lock()
+            return {'ok': True, 'result': None}
+        if command == 'key':
+            return {'ok': True,
+                    'result': base64.b64encode(self.vaultKey).decode('utf-8')}
+        self.refresh()
+        if command == 'list':
+            prefix = vault.normalizeText(request.get('prefix') or '')
+            result = []
+            for title in sorted(self.titles):
+                if title.startswith(prefix):
+                    result.extend([entry[1], entry[2]]
+                                  for entry in self.getEntries(title))
+            return {'ok': True, 'result': result}
+        if command in ['get', 'totp']:
+            entries = self.getEntries(request.get('title', ''))
+            if not entries:
+                return {'ok': False,
+                        'error': f"No entry titled {request.get('title')!r}."}
+            if command == 'totp':
+                return {'ok': True, 'result': [generateTOTP(entry[4])
+                                               for entry in entries]}
+            field = fields.get(request.get('field', 'password'))
+            if field == None:
+                return {'ok': False, 'error': 'Unknown field.'}
+            return {'ok': True, 'result': [entry[field] for entry in entries]}
+        return {'ok': False, 'error': f'Unknown command {command!r}.'}
+
+    # only processes of the user running the agent may talk to it; the
+    # socket's permissions already say so, and on Linux the peer's uid is
+    # checked too
+    def isPeerAllowed(self, connection):
+        uid = getPeerUid(connection)
+        return uid == None or uid == os.getuid()
+
+    def lock(self):
+        self.vaultKey = None
+        self.titles = {}
+        if self.server:
+            self.server.locked = True
+
+    def serve(self):
+        directory = os.path.dirname(self.socketPath)
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        if directory == getPrivateDirectory():
+            checkPrivateDirectory(directory)
+        if os.path.exists(self.socketPath):
+            if isRunning(self.socketPath):
+                raise OSError(f'An agent is already listening on '
+                              f'{self.socketPath}.')
+            os.unlink(self.socketPath)
+        # the socket is created without group or other permissions, rather
+        # than restricted after it is already listening
+        umask = os.umask(0o177)
+        try:
+            self.server = socketserver.UnixStreamServer(self.socketPath,
+                                                        AgentHandler)
+        finally:
+            os.umask(umask)
+        self.server.agent = self
+        self.server.locked = False
+        # wake up every second to check the idle timeout
+        self.server.timeout = 1
+        try:
+            while not self.server.locked:
+                self.server.handle_request()
+                if time.monotonic() - self.lastRequest > self.idleTime:
+                    self.lock()
+        finally:
+            self.lock()
+            self.server.server_close()
+            if os.path.exists(self.socketPath):
+                os.unlink(self.socketPath)
+
+# send one request to the agent and return its response, or None if no
+# agent is listening; a socket served by another user is not trusted, since
+# it could forge its answers
+def request(message, socketPath=None, timeout=2):
+    socketPath = socketPath or getSocketPath()
+    if not os.path.exists(socketPath):
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(timeout)
+            client.connect(socketPath)
+            uid = getPeerUid(client)
+            if uid != None and uid != os.getuid():
+                return None
+            client.sendall(json.dumps(message).encode('utf-8') + b'\n')
+            with client.makefile('rb') as reader:
+                line = reader.readline()
+    except OSError:
+        return None
+    return json.loads(line) if line else None
+
+def isRunning(socketPath=None):
+    return request({'command': 'ping'}, socketPath) != None
+
+# the vault key of dbPath held by the agent, or None; it is checked against
+# the vault's key check, so a stale agent can never hand out a wrong key
+def getVaultKey(dbPath, socketPath=None):
+    response = request({'command': 'key', 'db': getVaultPath(dbPath)},
+                       socketPath)
+    if not response or not response['ok']:
+        return None
+    vaultKey = base64.b64decode(response['result'])
+    if vault.decrypt(vaultKey, vault.getMetadata().get('check', '')) \
+    != vault.keyCheckText:
+        return None
+    return vaultKey
@@ -0,0 +1,230 @@
+# times the operations the app spends its time in against synthetic vaults
+# of different sizes and writes the results as JSON, so runs before and
+# after a change can be compared; like steelpass.py it never imports
+# cmu_graphics, so it runs without a window
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import statistics
+import tempfile
+import tracemalloc
+import vault
+import kdf
+from entries import EntryStore
+from search import SearchIndex
+from totp import totpEngine
+from passwords import PasswordPolicy, generateMany, getWordlist
+
+masterKey = 'benchmark'
+# the synthetic vaults are not calibrated to the machine, so the unlock
+# times of different machines and runs stay comparable
+kdfParams = kdf.legacyParams
+defaultSizes = [10, 1000, 10000, 100000]
+# a real-looking seed for every other entry
+seed = 'JBSWY3DPEHPK3PXP'
+
+# a vault with count entries, made once per size and reused by later runs
+# (the KDF still runs at every unlock)
+def makeVault(directory, count):
+    path = os.path.join(directory, f'vault-{count}.db')
+    if os.path.exists(path):
+        return path
+    partPath = path + '.part'
+    for suffix in ['', '-wal', '-shm']:
+        if os.path.exists(partPath + suffix):
+            os.remove(partPath + suffix)
+    vault.store = vault.VaultStore(partPath)
+    vault.createDB()
+    vaultKey = vault.writeVaultHeader(masterKey, kdfParams)
+    # titles from the passphrase wordlist, so searches hit realistic n-grams
+    words = getWordlist()
+    generator = random.Random(count)
+    with vault.store.transaction():
+        for start in range(0, count, 1000):
+            vault.store.executemany(vault.store.insertEntrySQL, [
+                (vault.sealEntry(vaultKey,
+                    f'{words[generator.randrange(len(words))]} {i}',
+                    f'user{i}@example.com',
+                    ''.join(generator.choice('abcdefgh0123456789')
+                            for j in range(16)),
+                    seed if i % 2 else ''), 0)
+                for i in range(start, min(count, start+1000))
+            ])
+    vault.store.close()
+    os.replace(partPath, path)
+    return path
+
+# run function repeat times and return the timings in milliseconds;
+# setup runs before every call without being timed
+def measure(function, repeat, setup=None):
+    times = []
+    for i in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+def getResult(name, entries, times):
+    return {
+        'name': name,
+        'entries': entries,
+        'repeat': len(times),
+        'minMs': min(times),
+        'medianMs': statistics.median(times),
+        'meanMs': statistics.mean(times),
+        'maxMs': max(times)
+    }
+
+# what the GUI's UnlockTask and addUnlockedEntries do for the whole vault:
+# the rows stream in a batch at a time and each batch goes into the search
+# index and the entry store at once
+def unlock():
+    vaultKey = vault.unlockVault(masterKey)
+    searchIndex = SearchIndex()
+    entryStore = EntryStore()
+    for entries, corruptIDs in vault.iterSealedEntries(vaultKey):
+        searchIndex.addMany([(entry[0], entry[1], entry[3])
+                             for entry in entries])
+        entryStore.extend(entries)
+    return vaultKey, searchIndex
+
+# the memory the GUI's entry store takes per entry, on top of the titles and
+# sealed blobs it shares with the rows it was made from
+def measureStore(entries):
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        store = EntryStore(entries)
+        used = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    return {
+        'name': 'entryStoreMemory',
+        'entries': len(store),
+        'bytesPerEntry': used / max(1, len(store))
+    }
+
+def benchmarkVault(path, count, repeat):
+    vault.store = vault.VaultStore(path)
+    # vaults kept from older runs get the columns added since
+    vault.createDB()
+    results = []
+    results.append(getResult('unlock', count,
+                             measure(unlock, max(1, repeat//4))))
+    vaultKey, searchIndex = unlock()
+
+    # NewEntryForm.saveEntry: write the row and splice it into the index;
+    # every entry saved here is deleted again below
+    added = []
+    def save():
+        entryID = vault.addEntry(f'benchmark {len(added)}', 'me', 'secret',
+                                 seed, vaultKey)
+        searchIndex.add(entryID, f'benchmark {len(added)}', 'me')
+        added.append(entryID)
+    results.append(getResult('save', count, measure(save, repeat)))
+
+    def update():
+        vault.updateEntry(added[0], 'benchmark 0', 'me', 'changed', seed,
+                          vaultKey)
+        searchIndex.add(added[0], 'benchmark 0', 'me')
+    results.append(getResult('update', count, measure(update, repeat)))
+
+    def delete():
+        entryID = added.pop()
+        vault.deleteEntry(entryID)
+        searchIndex.remove(entryID)
+    results.append(getResult('delete', count, measure(delete, repeat)))
+
+    # typing a query one key at a time, each keystroke timed on its own
+    titles = list(searchIndex.titles.values())
+    generator = random.Random(0)
+    times = []
+    for i in range(repeat):
+        query = generator.choice(titles)[:8]
+        searchIndex.lastQuery = None
+        for length in range(1, len(query)+1):
+            start = time.perf_counter()
+            searchIndex.search(query[:length], limit=1)
+            times.append((time.perf_counter() - start) * 1000)
+    results.append(getResult('searchKeystroke', count, times))
+
+    # EntryView.reveal of an entry and its two neighbours
+    sealed = [entry[2] for entry in vault.getSealedEntries(vaultKey)[:3]]
+    results.append(getResult('reveal', count, measure(
+        lambda: [vault.openSealed(vaultKey, value) for value in sealed],
+        repeat)))
+
+    results.append(getResult('getEntries', count, measure(
+        lambda: vault.getEntries(vaultKey), max(1, repeat//4))))
+    results.append(measureStore(vault.getSealedEntries(vaultKey)))
+    vault.store.close()
+    return results
+
+def benchmarkGenerators(repeat):
+    results = []
+    for name, policy in [
+        ('password', PasswordPolicy(16)),
+        ('password64', PasswordPolicy(64)),
+        ('passphrase', PasswordPolicy(6, passphrase=True))
+    ]:
+        results.append(getResult(name, None, measure(
+            lambda: generateMany(1, policy), repeat)))
+
+    # refreshTOTP at a period rollover: the three revealed views get the
+    # code of a new time step
+    now = [time.time()]
+    def refresh():
+        now[0] += 30
+        for i in range(3):
+            totpEngine.getCode(seed, now[0])
+    results.append(getResult('totpRefresh', None, measure(refresh, repeat)))
+    results.append(getResult('totpColdRefresh', None,
+                             measure(refresh, repeat, totpEngine.clear)))
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='benchmark',
+        description='Time SteelPass operations on synthetic vaults and '
+                    'write the results as JSON.')
+    parser.add_argument('--sizes', default=','.join(map(str, defaultSizes)),
+                        help='comma-separated vault sizes '
+                             '(default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=20,
+                        help='timed runs per operation (default: 20)')
+    parser.add_argument('--directory',
+        default=os.path.join(tempfile.gettempdir(), 'steelpass-benchmark'),
+        help='where the synthetic vaults are kept between runs')
+    parser.add_argument('--output', default='-',
+                        help='JSON file for the results (default: stdout)')
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.directory, exist_ok=True)
+    results = benchmarkGenerators(args.repeat)
+    for count in [int(size) for size in args.sizes.split(',')]:
+        print(f'{count} entries...', file=sys.stderr)
+        path = makeVault(args.directory, count)
+        results.extend(benchmarkVault(path, count, args.repeat))
+
+    report = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'kdf': kdf.describeParams(kdfParams),
+        'results': results
+    }
+    if args.output == '-':
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+if __name__ == '__main__':
+    main()
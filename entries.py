@@ -0,0 +1,168 @@
+# the unlocked vault in memory: one column per field instead of a tuple per
+# entry, so a large vault costs a few pointers and a sort key per entry,
+# and Entry records that are only made for the entries being looked at
+import bisect
+from array import array
+from vault import openSealed
+
+# an entry being shown; its username, password and seed are only kept
+# while it is revealed, as bytearrays that wipe() zeroes in place
+class Entry:
+    __slots__ = ['id', 'title', 'sealed', 'secrets']
+
+    def __init__(self, id, title, username=None, password=None, seed=None,
+                 sealed=None):
+        self.id = id
+        self.title = title
+        # the sealed fields from vault.getSealedEntries, or None for an
+        # entry that only lives in memory (like the welcome entry)
+        self.sealed = sealed
+        self.secrets = None
+        if username != None:
+            self.setSecrets(username, password, seed)
+
+    @property
+    def username(self):
+        return self.getSecret(0)
+
+    @property
+    def password(self):
+        return self.getSecret(1)
+
+    @property
+    def seed(self):
+        return self.getSecret(2)
+
+    # a secret as text, or '' while the entry is concealed
+    def getSecret(self, index):
+        if self.secrets == None:
+            return ''
+        return self.secrets[index].decode('utf-8')
+
+    def setSecrets(self, username, password, seed):
+        self.wipe()
+        self.secrets = [bytearray((field or '').encode('utf-8'))
+                        for field in [username, password, seed]]
+
+    def isRevealed(self):
+        return self.sealed == None or self.secrets != None
+
+    # decrypt the secrets the first time they are needed
+    def reveal(self, vaultKey):
+        if not self.isRevealed():
+            self.setSecrets(*openSealed(vaultKey, self.sealed))
+
+    # overwrite the secrets before letting go of them; strings already made
+    # from them (textboxes, the clipboard) are not reachable from here
+    def wipe(self):
+        if self.secrets == None:
+            return
+        for secret in self.secrets:
+            secret[:] = bytes(len(secret))
+        self.secrets = None
+
+    # drop the secrets of a sealed entry once it is out of reach
+    def conceal(self):
+        if self.sealed != None:
+            self.wipe()
+
+# the sort key of a title; a title that is already lowercase is its own key,
+# so the string is not kept twice
+def getSortKey(title):
+    key = title.lower()
+    return title if key == title else key
+
+# a copy of column with values[i] inserted before positions[i], which are
+# in ascending order
+def mergeColumn(column, positions, values):
+    merged = column[:0]
+    start = 0
+    for i in range(len(values)):
+        merged += column[start:positions[i]]
+        merged.append(values[i])
+        start = positions[i]
+    merged += column[start:]
+    return merged
+
+# every entry of the vault sorted by title, then ID, kept as parallel
+# columns; getEntry makes the Entry of a row the first time it is asked for
+# and hands out the same record until the row is released
+class EntryStore:
+    def __init__(self, rows=()):
+        self.ids = array('q')
+        self.keys = []
+        self.titles = []
+        self.sealed = []
+        # entry ID -> Entry, for the rows that have one
+        self.records = {}
+        self.extend(rows)
+
+    def __len__(self):
+        return len(self.ids)
+
+    # add (id, title, sealed, ...) rows, as vault.iterSealedEntries yields
+    # them; the batch is sorted on its own and merged into the columns in
+    # one pass, rather than inserted a row at a time
+    def extend(self, rows):
+        rows = sorted((getSortKey(row[1]), row[0], row[1], row[2])
+                      for row in rows)
+        positions = [self.find(row[1], row[2]) for row in rows]
+        for name, field in [('keys', 0), ('ids', 1), ('titles', 2),
+                            ('sealed', 3)]:
+            setattr(self, name, mergeColumn(getattr(self, name), positions,
+                                            [row[field] for row in rows]))
+
+    # the index of the row of an entry: the run of rows with the same sort
+    # key is found first, then the ID within it
+    def find(self, entryID, title):
+        key = getSortKey(title)
+        start = bisect.bisect_left(self.keys, key)
+        end = bisect.bisect_right(self.keys, key, start)
+        return bisect.bisect_left(self.ids, entryID, start, end)
+
+    # add an Entry in its sorted position and return that position
+    def insert(self, entry):
+        index = self.find(entry.id, entry.title)
+        self.ids.insert(index, entry.id)
+        self.keys.insert(index, getSortKey(entry.title))
+        self.titles.insert(index, entry.title)
+        self.sealed.insert(index, entry.sealed)
+        self.records[entry.id] = entry
+        return index
+
+    # take out the row at index, wiping the secrets of its Entry
+    def pop(self, index):
+        entry = self.records.pop(self.ids[index], None)
+        if entry != None:
+            entry.wipe()
+        del self.ids[index]
+        del self.keys[index]
+        del self.titles[index]
+        del self.sealed[index]
+
+    def getEntry(self, index):
+        entryID = self.ids[index]
+        entry = self.records.get(entryID)
+        if entry == None:
+            entry = Entry(entryID, self.titles[index],
+                          sealed=self.sealed[index])
+            self.records[entryID] = entry
+        return entry
+
+    # wipe and forget the record of an entry that is out of sight; entries
+    # that only live in memory keep theirs, as it cannot be made again
+    def release(self, entryID):
+        entry = self.records.get(entryID)
+        if entry != None and entry.sealed != None:
+            entry.wipe()
+            del self.records[entryID]
+
+    # zero every secret held and drop all rows, when the vault locks
+    def wipe(self):
+        for entry in self.records.values():
+            entry.wipe()
+        self.records = {}
+        self.ids = array('q')
+        self.keys = []
+        self.titles = []
+        self.sealed = []
@@ -0,0 +1,70 @@
+import os
+from PIL import Image
+from cmu_graphics import CMUImage
+
+cacheVariable = 'STEELPASS_ASSET_CACHE'
+
+# where resized icons are kept between runs: $STEELPASS_ASSET_CACHE, or
+# steelpass/assets in the user's cache directory; setting the variable to
+# an empty string turns the disk cache off
+def getCacheDirectory():
+    if cacheVariable in os.environ:
+        return os.environ[cacheVariable] or None
+    base = os.environ.get('XDG_CACHE_HOME') or \
+           os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'steelpass', 'assets')
+
+# decodes each image the first time it is drawn and keeps a copy already
+# resized to every size it is drawn at, so drawImage never has to rescale;
+# with a cache directory the resized copies are also kept between runs
+class ImageCache:
+    def __init__(self, directory, cacheDirectory=None):
+        self.directory = directory
+        self.cacheDirectory = cacheDirectory
+        # file name -> decoded PIL image
+        self.sources = {}
+        # (file name, width, height) -> CMUImage of that size
+        self.scaled = {}
+
+    def getSource(self, name):
+        if name not in self.sources:
+            image = Image.open(os.path.join(self.directory, name))
+            image.load()
+            self.sources[name] = image
+        return self.sources[name]
+
+    def getCachePath(self, name, width, height):
+        # always PNG, so JPEG sources are not compressed a second time
+        stem = os.path.splitext(name)[0]
+        return os.path.join(self.cacheDirectory,
+                            f'{stem}-{width}x{height}.png')
+
+    # resize the source image, or reuse a copy resized on an earlier run
+    # as long as it is newer than the source
+    def getResized(self, name, width, height):
+        if self.cacheDirectory:
+            cachePath = self.getCachePath(name, width, height)
+            sourcePath = os.path.join(self.directory, name)
+            if os.path.exists(cachePath) and \
+            os.path.getmtime(cachePath) >= os.path.getmtime(sourcePath):
+                image = Image.open(cachePath)
+                image.load()
+                return image
+        image = self.getSource(name)
+        if image.size == (width, height):
+            return image
+        image = image.resize((width, height), Image.LANCZOS)
+        if self.cacheDirectory:
+            try:
+                os.makedirs(self.cacheDirectory, exist_ok=True)
+                image.save(cachePath)
+            except OSError:
+                # the cache is only an optimization
+                pass
+        return image
+
+    def get(self, name, width, height):
+        key = (name, round(width), round(height))
+        if key not in self.scaled:
+            self.scaled[key] = CMUImage(self.getResized(*key))
+        return self.scaled[key]
@@ -0,0 +1,133 @@
+# the key derivation that turns the master password into the vault key;
+# every vault stores the function and cost it was made with, so the cost
+# can be tuned to the machine (see calibrate) without breaking old vaults
+#
+# parameters are kept as a dict like {'kdf': 'scrypt', 'cost': 32768,
+# 'blockSize': 8, 'parallelism': 1}, and in the vault metadata as strings
+# under the same names
+import time
+import math
+import hashlib
+from profiler import profiler
+
+# the cost fields of each function; PBKDF2-SHA1 is only read, from vaults
+# made before the cost could be tuned
+kdfFields = {
+    'pbkdf2-sha1': ['iterations'],
+    'pbkdf2-sha256': ['iterations'],
+    'scrypt': ['cost', 'blockSize', 'parallelism']
+}
+# the functions new parameters can be made for
+tunableKdfs = ['scrypt', 'pbkdf2-sha256']
+defaultKdf = 'scrypt'
+# what vaults from before stored parameters were made with
+legacyParams = {'kdf': 'pbkdf2-sha1', 'iterations': 100000}
+
+# how long one unlock should spend deriving the key
+targetMs = 300
+# calibration never goes below these, however slow the machine
+minimumIterations = 50000
+minimumCost = 1 << 14
+# scrypt needs 128 * cost * blockSize bytes, which is capped here
+maximumScryptMemory = 256 << 20
+
+@profiler.timed('kdf')
+def deriveKey(masterKey, salt, params):
+    password = masterKey.encode('utf-8')
+    name = params['kdf']
+    if name in ['pbkdf2-sha1', 'pbkdf2-sha256']:
+        return hashlib.pbkdf2_hmac(name.split('-')[1], password, salt,
+                                   params['iterations'], 32)
+    if name == 'scrypt':
+        cost, blockSize, parallelism = params['cost'], params['blockSize'], \
+                                       params['parallelism']
+        # the default limit of 32 MiB is less than most calibrated costs need
+        return hashlib.scrypt(password, salt=salt, n=cost, r=blockSize,
+            p=parallelism, dklen=32,
+            maxmem=128*blockSize*(cost+parallelism+2) + (1 << 20))
+    raise ValueError(f'unknown key derivation function {name!r}')
+
+# the parameters stored in the vault metadata, or the ones being rotated to
+# with prefix 'next'
+def getParams(metadata, prefix=''):
+    name = metadata.get(getFieldName('kdf', prefix))
+    if name == None:
+        return dict(legacyParams)
+    if name not in kdfFields:
+        raise ValueError(f'unknown key derivation function {name!r}')
+    params = {'kdf': name}
+    for field in kdfFields[name]:
+        params[field] = int(metadata[getFieldName(field, prefix)])
+    return params
+
+# params as metadata values, with field names made like getParams reads them
+def formatParams(params, prefix=''):
+    return {getFieldName(field, prefix): str(value)
+            for field, value in params.items()}
+
+# every metadata name any parameters could be stored under
+def getAllFieldNames(prefix=''):
+    fields = {'kdf'}
+    for names in kdfFields.values():
+        fields.update(names)
+    return sorted(getFieldName(field, prefix) for field in fields)
+
+def getFieldName(field, prefix=''):
+    return prefix + field[0].upper() + field[1:] if prefix else field
+
+def describeParams(params):
+    if params['kdf'] == 'scrypt':
+        return (f"scrypt N=2^{int(math.log2(params['cost']))} "
+                f"r={params['blockSize']} p={params['parallelism']}")
+    return f"{params['kdf']} {params['iterations']} iterations"
+
+# parameters with the given cost, checked the way deriveKey would need them
+def makeParams(name, iterations=None, cost=None, blockSize=8,
+               parallelism=1):
+    if name not in kdfFields:
+        raise ValueError(f'unknown key derivation function {name!r}')
+    if name == 'scrypt':
+        if not cost or cost < 2 or cost & (cost - 1):
+            raise ValueError('the scrypt cost must be a power of two')
+        return {'kdf': name, 'cost': cost, 'blockSize': blockSize,
+                'parallelism': parallelism}
+    if not iterations or iterations < 1:
+        raise ValueError('there must be at least one iteration')
+    return {'kdf': name, 'iterations': iterations}
+
+# milliseconds one derivation with params takes
+def measureKdf(params):
+    start = time.perf_counter()
+    deriveKey('calibration', bytes(16), params)
+    return (time.perf_counter() - start) * 1000
+
+# the parameters that make one derivation take about targetMs on this
+# machine; the cost is doubled from the minimum until a run takes a tenth
+# of the target, then scaled up, since both functions take time linear in
+# their cost; scrypt costs are powers of two, and its memory is capped
+def calibrate(name=defaultKdf, targetMs=targetMs, blockSize=8,
+              parallelism=1):
+    if name == 'scrypt':
+        field = 'cost'
+        minimum = minimumCost
+        maximum = maximumScryptMemory // (128*blockSize)
+        params = makeParams(name, cost=minimum, blockSize=blockSize,
+                            parallelism=parallelism)
+    else:
+        field = 'iterations'
+        minimum = minimumIterations
+        maximum = None
+        params = makeParams(name, iterations=minimum)
+    while True:
+        ms = measureKdf(params)
+        if ms >= targetMs/10 or (maximum and params[field] >= maximum):
+            break
+        params[field] *= 2
+    cost = params[field] * targetMs / max(ms, 0.001)
+    if name == 'scrypt':
+        cost = 1 << max(0, round(math.log2(cost)))
+        cost = min(maximum, cost)
+    else:
+        cost = round(cost, -3)
+    params[field] = max(minimum, int(cost))
+    return params
@@ -1,182 +1,36 @@
 from cmu_graphics import *
 import time
 import string
-import random
-import sqlite3
-from PIL import Image
-from Crypto.Cipher import AES
-from Crypto.Random import get_random_bytes
-from Crypto.Util.Padding import pad, unpad
-from Crypto.Protocol.KDF import PBKDF2
-import base64
 import pyperclip
-import hmac
-import hashlib
-import struct
+from collections import OrderedDict
+from vault import (createDB, isVaultEmpty, addEntry, updateEntry, deleteEntry,
+                   sealEntry, clearKeys, StaleKeyError)
+from entries import Entry, EntryStore
+from totp import totpEngine, generateTOTP
+from search import SearchIndex
+from passwords import PasswordPolicy, generateMany
+from images import ImageCache, getCacheDirectory
+from scheduler import Scheduler
+from textbuffer import GapBuffer
+from profiler import profiler
+from unlock import UnlockTask
+import agent
 
 # global styling constants
 fontSize = 20
 characterWidth = (fontSize*3)//5
 steelGray = gradient(rgb(153, 158, 152), rgb(203, 205, 205), start='top-left')
 
-# global background and button icons
-steelImage = CMUImage(Image.open('assets/steel.jpeg'))
-pencilImages = (CMUImage(Image.open('assets/pencil.png')),
-                CMUImage(Image.open('assets/steel-pencil.png')))
-trashImages = (CMUImage(Image.open('assets/trash.png')),
-               CMUImage(Image.open('assets/steel-trash.png')))
-plusImages = (CMUImage(Image.open('assets/plus.png')),
-              CMUImage(Image.open('assets/steel-plus.png')))
-generateImages = (CMUImage(Image.open('assets/generate.png')),
-                  CMUImage(Image.open('assets/steel-generate.png')))
-hideImages = (CMUImage(Image.open('assets/hide.png')),
-              CMUImage(Image.open('assets/steel-hide.png')))
-copyImages = (CMUImage(Image.open('assets/copy.png')),
-              CMUImage(Image.open('assets/steel-copy.png')))
-
-def encrypt(key, data):
-    # generate a random 16-byte salt to hash the key
-    salt = get_random_bytes(16)
-    # hash the key using the salt
-    key = PBKDF2(key.encode('utf-8'), salt, dkLen=32, count=100000)
-    # generate a random 16-byte IV
-    iv = get_random_bytes(16)
-    # create the cipher object
-    cipher = AES.new(key, AES.MODE_CBC, iv)
-    # pad the message to be a multiple of AES block size (16 bytes)
-    paddedData = pad(data.encode('utf-8'), AES.block_size)
-    # encrypt the padded message
-    ciphertext = cipher.encrypt(paddedData)
-    # combine the IV and ciphertext and encode them in base64
-    encryptedData = base64.b64encode(salt + iv + ciphertext).decode('utf-8')
-
-    return encryptedData
-
-def decrypt(key, data):
-    try:
-        # decode base64 encoding
-        encryptedData = base64.b64decode(data)
-        # get salt (first 16 bytes), IV (next 16 bytes),
-        # and ciphertext (remaining bytes)
-        salt = encryptedData[:16]
-        iv = encryptedData[16:32]
-        ciphertext = encryptedData[32:]
-        # hash the key using the salt
-        key = PBKDF2(key.encode('utf-8'), salt, dkLen=32, count=100000)
-        # create the cipher object
-        cipher = AES.new(key, AES.MODE_CBC, iv)
-        # decrypt the ciphertext and remove padding
-        decryptedData = unpad(cipher.decrypt(ciphertext), AES.block_size)
-
-        return decryptedData.decode('utf-8')
-    except:
-        # either the key is invalid or the data is corrupt
-        return False
-
-def generateTOTP(seed):
-    try:
-        if not seed:
-            return ''
-        seed = seed.replace(' ', '')
-        seed = seed.upper()
-        # get the current 30-second period
-        currentTime = int(time.time() // 30)
-        # decode the Base32 seed to bytes
-        seed = base64.b32decode(seed)
-        # pack current time into an 8-byte big-endian value
-        timeBytes = struct.pack(">Q", currentTime)
-        # use HMAC-SHA1 to hash the time with the seed
-        hmacHash = hmac.new(seed, timeBytes, hashlib.sha1).digest()
-        # extract a 4-byte segment from the hash
-        offset = hmacHash[-1] & 0x0F
-        # 31 bits to avoid negatives
-        code = struct.unpack(">I", hmacHash[offset:offset+4])[0] & 0x7FFFFFFF
-        # reduce to 6 digits
-        otp = code % (10 ** 6)
-
-        return str(otp).zfill(6)
-    except:
-        return 'Unrecognizable seed format'
-
-# create a new database and table if they do not already exist
-def createDB():
-    conn = sqlite3.connect('entries.db')
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS entries (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT,
-            username TEXT,
-            password TEXT,
-            seed TEXT
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-# get all entries from table
-def getEntries(masterKey):
-    conn = sqlite3.connect('entries.db')
-    c = conn.cursor()
-    c.execute('SELECT * FROM entries')
-    entries = c.fetchall()
-    conn.close()
-    if not entries:
-        return None
-    if decrypt(masterKey, entries[0][1]) == False:
-        return False
-    for i in range(len(entries)):
-        entries[i] = (
-            entries[i][0],
-            decrypt(masterKey, entries[i][1]),
-            decrypt(masterKey, entries[i][2]),
-            decrypt(masterKey, entries[i][3]),
-            decrypt(masterKey, entries[i][4])
-        )
-    return entries
-
-# add entry to table
-def addEntry(title, username, password, seed, masterKey):
-    title = encrypt(masterKey, title)
-    username = encrypt(masterKey, username)
-    password = encrypt(masterKey, password)
-    seed = encrypt(masterKey, seed)
-
-    conn = sqlite3.connect('entries.db')
-    c = conn.cursor()
-    c.execute('''
-        INSERT INTO entries (title, username, password, seed)
-        VALUES (?, ?, ?, ?)
-    ''', (title, username, password, seed))
-    conn.commit()
-    conn.close()
-    return c.lastrowid
-
-# update an entry if it has the same title
-def updateEntry(entryID, title, username, password, seed, masterKey):
-    title = encrypt(masterKey, title)
-    username = encrypt(masterKey, username)
-    password = encrypt(masterKey, password)
-    seed = encrypt(masterKey, seed)
-
-    conn = sqlite3.connect('entries.db')
-    c = conn.cursor()
-    c.execute('''
-    UPDATE entries
-    SET title = ?, username = ?, password = ?, seed = ?
-    WHERE id = ?
-    ''', (title, username, password, seed, entryID))
-    conn.commit()
-    conn.close()
-
-def deleteEntry(entryID):
-    conn = sqlite3.connect('entries.db')
-    c = conn.cursor()
-    c.execute('''
-    DELETE FROM entries WHERE id = ?
-    ''', (entryID,))
-    conn.commit()
-    conn.close()
+# global background and button icons, as file names in assets that are only
+# decoded when first drawn (the first icon of a pair is the hovered one)
+imageCache = ImageCache('assets', getCacheDirectory())
+steelImage = 'steel.jpeg'
+pencilImages = ('pencil.png', 'steel-pencil.png')
+trashImages = ('trash.png', 'steel-trash.png')
+plusImages = ('plus.png', 'steel-plus.png')
+generateImages = ('generate.png', 'steel-generate.png')
+hideImages = ('hide.png', 'steel-hide.png')
+copyImages = ('copy.png', 'steel-copy.png')
 
 class Textbox:
     def __init__(self, x, y, w, h, text='', placeholder=''):
@@ -197,39 +51,71 @@ class Textbox:
         # index of the blinking cursor that controls the view
         self.cursorIndex = min(len(text), self.maxChars)
 
+    # the text lives in a gap buffer so edits at the cursor don't copy the
+    # whole text; reading .text joins it once and keeps the result until
+    # the next edit
+    @property
+    def text(self):
+        if self.textCache == None:
+            self.textCache = str(self.buffer)
+        return self.textCache
+
+    @text.setter
+    def text(self, text):
+        self.buffer = GapBuffer(text)
+        self.changed()
+
+    def changed(self):
+        self.textCache = None
+        # (viewIndex, text) of the last drawn window
+        self.viewCache = None
+        # counts edits, so a change can be noticed without reading the text
+        self.version = getattr(self, 'version', 0) + 1
+
+    # the part of the text that fits in the box, only sliced again after an
+    # edit or a scroll
+    def getVisibleText(self):
+        if self.viewCache == None or self.viewCache[0] != self.viewIndex:
+            self.viewCache = (self.viewIndex,
+                self.buffer.getSlice(self.viewIndex,
+                                     self.viewIndex+self.maxChars))
+        return self.viewCache[1]
+
+    def getLength(self):
+        return len(self.buffer)
+
     def draw(self):
         drawRect(self.x, self.y, self.w, self.h, fill=None,
                     border=steelGray, borderWidth=2)
-        text = self.text[self.viewIndex:self.viewIndex+self.maxChars]
+        text = self.getVisibleText()
         if hasattr(self, 'hide') and self.hide:
             text = '*' * len(text)
         # start characterWidth pixels to the right after the rectangle left edge
         drawLabel(text, self.x+characterWidth, self.y+self.h/2, align='left',
         fill=steelGray, size=fontSize, font='monospace')
-        if not self.text:
+        if not self.getLength():
             drawLabel(self.placeholder, self.x+characterWidth, self.y+self.h/2,
                       align='left', fill='dimGray', size=fontSize,
                       font='monospace')
 
     def blinkCursor(self):
         # offset the cursor to the right (+1) of last character
-        offset = (len(
-                    self.text[self.viewIndex:self.cursorIndex]
-                    ) + 1) * characterWidth
+        offset = (max(0, min(self.cursorIndex, self.getLength())
+                      - self.viewIndex) + 1) * characterWidth
         drawLine(self.x + offset, self.y+characterWidth,
                 self.x + offset, self.y+self.h-characterWidth,
                 fill='white', lineWidth=1)
 
     def shiftCursor(self, steps):
         # if cursor shift is within text length, shift it by steps
-        if 0 <= self.cursorIndex + steps <= len(self.text):
+        if 0 <= self.cursorIndex + steps <= self.getLength():
             self.cursorIndex += steps
             # if the cursor exceeds ends of the view, shift the view by steps
             if self.cursorIndex > self.viewIndex+self.maxChars \
             or self.cursorIndex < self.viewIndex:
                 self.viewIndex += steps
-        elif self.cursorIndex + steps > len(self.text):
-            self.cursorIndex = len(self.text)
+        elif self.cursorIndex + steps > self.getLength():
+            self.cursorIndex = self.getLength()
 
     def checkMouseClick(self, mouseX, mouseY):
         # do nothing if click is out of the rectangle
@@ -246,20 +132,20 @@ class Textbox:
 
     def write(self, data):
         # insert at cursor location
-        self.text = self.text[:self.cursorIndex] + data + \
-                    self.text[self.cursorIndex:]
+        self.buffer.insert(self.cursorIndex, data)
+        self.changed()
         self.shiftCursor(len(data))
 
     def erase(self):
         # erase behind cursor location
         if self.cursorIndex > 0:
-            self.text = self.text[:self.cursorIndex-1] + \
-                        self.text[self.cursorIndex:]
+            self.buffer.delete(self.cursorIndex-1)
+            self.changed()
         self.shiftCursor(-1)
 
     def copyToClipboard(self, app):
         pyperclip.copy(self.text)
-        app.clipboardCounter = app.clipboardTime
+        startClipboardTimer(app)
 
 # special textbox that generates passwords
 class PasswordField(Textbox):
@@ -271,25 +157,41 @@ class PasswordField(Textbox):
                          passphrase):
         if not length.isdigit():
             return
-        length = int(length)
-        password = ''
-        if passphrase:
-            elements = open('lotsofwords.txt', 'r').read().splitlines()
-        else:
-            elements = ''
-            elements += string.ascii_uppercase if uppers else ''
-            elements += string.ascii_lowercase if lowers else ''
-            elements += string.digits if nums else ''
-            elements += string.punctuation if specials else ''
-        if elements:
-            for i in range(length):
-                password += random.choice(elements)
-                if passphrase and i != length-1:
-                    password += '-'
-        self.text = password
+        policy = PasswordPolicy(int(length), uppers, lowers, nums, specials,
+                                passphrase)
+        self.text = generateMany(1, policy)[0]
         self.viewIndex = 0
         self.cursorIndex = len(self.text)
 
+# a read-only box showing one secret of an Entry; the text is decoded from
+# the Entry's bytearray whenever it is drawn or copied and never kept, so
+# wiping the Entry leaves no copy of it in the view
+class SecretField(PasswordField):
+    def __init__(self, x, y, w, h, entry, index, placeholder='', hide=True):
+        self.entry = entry
+        self.index = index
+        super().__init__(x, y, w, h, '', placeholder, hide)
+
+    @property
+    def text(self):
+        return self.entry.getSecret(self.index)
+
+    @text.setter
+    def text(self, text):
+        self.changed()
+
+    def getVisibleText(self):
+        return self.text[self.viewIndex:self.viewIndex+self.maxChars]
+
+    def getLength(self):
+        return len(self.text)
+
+    def write(self, data):
+        pass
+
+    def erase(self):
+        pass
+
 class Button:
     def __init__(self, x, y, w, h, content, action, hover=False):
         self.x = x
@@ -308,8 +210,8 @@ class Button:
                  border=steelGray)
         if type(self.content) == tuple:
             image = self.content[0] if self.hover else self.content[1]
-            drawImage(image, self.x+self.w/8, self.y+self.w/8,
-                      width=0.75*self.w, height=0.75*self.h)
+            drawImage(imageCache.get(image, 0.75*self.w, 0.75*self.h),
+                      self.x+self.w/8, self.y+self.w/8)
         else:
             drawLabel(self.content, self.x+self.w/2, self.y+self.h/2,
                       fill=fontColor, size=fontSize, font='monospace')
@@ -341,8 +243,8 @@ class ActivateButton(Button):
                  border=steelGray)
         if type(self.content) == tuple:
             image = self.content[0] if self.active else self.content[1]
-            drawImage(image, self.x+self.w/8, self.y+self.w/8,
-                      width=0.75*self.w, height=0.75*self.h)
+            drawImage(imageCache.get(image, 0.75*self.w, 0.75*self.h),
+                      self.x+self.w/8, self.y+self.w/8)
         else:
             fontColor = 'black' if self.active else steelGray
             drawLabel(self.content, self.x+self.w/2, self.y+self.h/2,
@@ -359,7 +261,7 @@ class Form:
 
     def draw(self, opacity=10, border=None):
         drawRect(self.x, self.y, self.w, self.h, fill='black')
-        drawImage(steelImage, self.x, self.y, width=self.w, height=self.h,
+        drawImage(imageCache.get(steelImage, self.w, self.h), self.x, self.y,
                   opacity=opacity, border=border)
 
 class FloatingForm(Form):
@@ -396,25 +298,66 @@ class FloatingForm(Form):
         ]
 
     def draw(self, app):
-        totalEntries = \
-            len(app.forms) - int(type(app.forms[app.inFocusForm]) != EntryView)
-        drawLabel(f'{app.inFocusForm+1}/{totalEntries}', self.w/2, 40, size=24,
-                  fill=steelGray, font='monospace')
+        drawLabel(f'{app.inFocusForm+1}/{len(app.forms)}', self.w/2, 40,
+                  size=24, fill=steelGray, font='monospace')
         for textbox in self.textboxes:
             textbox.draw()
         for button in self.buttons:
             button.draw()
 
+# placeholder shown while the vault has no entries; a new Entry every time,
+# since the one taken out of the list gets wiped
+welcomeID = -1
+
+def getWelcomeEntry():
+    return Entry(welcomeID, 'Welcome!',
+                 'Click the + to add your first entry...', 'Enjoy :)', '')
+
+# the number of built EntryViews kept around besides the visible ones
+viewCacheSize = 8
+
+# the unlocked vault as a list of EntryViews sorted by title; the entries
+# themselves are kept in the columns of an EntryStore, and a view is built
+# around the store's Entry the first time its index is looked up, keeping
+# the most recently used views in a small cache
+class FormList(EntryStore):
+    def __init__(self, app, rows):
+        self.app = app
+        # entry ID -> EntryView, least recently used first
+        self.views = OrderedDict()
+        super().__init__(rows)
+
+    def __getitem__(self, index):
+        entry = self.getEntry(index)
+        view = self.views.get(entry.id)
+        if view == None:
+            view = EntryView(self.app, self.app.width, self.app.height, entry)
+            self.views[entry.id] = view
+            # the focused view and its neighbours are always the most
+            # recently used, so evicting the oldest never drops one of them
+            if len(self.views) > viewCacheSize + 3:
+                self.release(self.views.popitem(last=False)[0])
+        else:
+            self.views.move_to_end(entry.id)
+        return view
+
+    def pop(self, index):
+        self.views.pop(self.ids[index], None)
+        super().pop(index)
+
 class EntryView(Form):
     def __init__(self, app, w, h, entry):
         super().__init__(app, w, h)
+        # the Entry in app.forms; while the view is concealed it only has
+        # the title and the sealed fields
         self.entry = entry
         self.textboxes = [
-            Textbox(150, 330, 430, 50, entry[2], 'No username'),
-            PasswordField(150, 400, 360, 50, entry[3], 'No password'),
-            PasswordField(150, 470, 430, 50, generateTOTP(entry[4]),
+            SecretField(150, 330, 430, 50, entry, 0, 'No username', False),
+            SecretField(150, 400, 360, 50, entry, 1, 'No password'),
+            PasswordField(150, 470, 430, 50, '',
                           '2FA is not enabled for this entry', hide=False)
         ]
+        self.showTOTP()
         # the index of the textbox currently in focus
         self.inFocusTB = 0
 
@@ -432,30 +375,89 @@ class EntryView(Form):
                    lambda: self.textboxes[2].copyToClipboard(app))
         ]
 
-        app.forms.append(self)
+    # the username and password boxes read the Entry as they are drawn, so
+    # only the TOTP code is kept as text, and only while the entry is
+    # revealed
+    def showTOTP(self):
+        self.textboxes[2].text = generateTOTP(self.entry.seed)
+
+    # decrypt the username, password and seed the first time they are needed
+    def reveal(self, app):
+        if self.entry.isRevealed():
+            return
+        self.entry.reveal(app.vaultKey)
+        self.showTOTP()
+
+    # wipe the plaintext again once the view is out of reach
+    def conceal(self):
+        if self.entry.sealed == None:
+            return
+        self.entry.conceal()
+        self.showTOTP()
+
+    # focus the view at index, revealing it and its neighbours and
+    # concealing any view that is no longer next to the focused one
+    @classmethod
+    def focusForm(self, app, index):
+        app.inFocusForm = index
+        nearby = set()
+        for i in [index-1, index+1, index]:
+            form = app.forms[i % len(app.forms)]
+            form.reveal(app)
+            nearby.add(form)
+        for form in app.revealedForms - nearby:
+            form.conceal()
+        app.revealedForms = nearby
+        refreshTOTP(app)
 
     def hidePassword(self):
         self.textboxes[1].hide = not self.textboxes[1].hide
 
     @classmethod
     def changeFormView(self, app, steps):
-        app.inFocusForm = (app.inFocusForm+steps) % len(app.forms)
+        EntryView.focusForm(app, (app.inFocusForm+steps) % len(app.forms))
 
     @classmethod
     def searchEntries(self, app, match):
-        for i in range(len(app.forms)):
-            if app.forms[i].entry[1].lower().startswith(match.lower()):
-                app.inFocusForm = i
-                break
+        results = app.searchIndex.search(match, limit=1)
+        if results:
+            entryID = results[0]
+            EntryView.focusForm(app, app.forms.find(entryID,
+                                    app.searchIndex.titles[entryID]))
+
+    # seal a saved Entry, splice it into its sorted position and focus it;
+    # the view itself is built by the focus, and finds the entry revealed
+    @classmethod
+    def spliceEntry(self, app, entry):
+        if app.forms.ids[0] == welcomeID:
+            app.forms.pop(0)
+        entry.sealed = sealEntry(app.vaultKey, entry.title, entry.username,
+                                 entry.password, entry.seed)
+        index = app.forms.insert(entry)
+        app.searchIndex.add(entry.id, entry.title, entry.username)
+        EntryView.focusForm(app, index)
+
+    # take this view's row out of app.forms without reloading the others
+    def removeView(self, app):
+        entryID = self.entry.id
+        index = app.forms.find(entryID, self.entry.title)
+        app.forms.pop(index)
+        app.revealedForms.discard(self)
+        if entryID in app.searchIndex.titles:
+            app.searchIndex.remove(entryID)
+        return index
 
     def deleteEntry(self, app):
-        deleteEntry(self.entry[0])
-        loadEntries(app)
+        deleteEntry(self.entry.id)
+        index = self.removeView(app)
+        if not app.forms:
+            app.forms.insert(getWelcomeEntry())
+        EntryView.focusForm(app, index % len(app.forms))
 
     def draw(self):
         super().draw()
-        drawLabel(self.entry[1], self.w/2, self.h*0.3, size=64, fill=steelGray,
-                  font='monospace')
+        drawLabel(self.entry.title, self.w/2, self.h*0.3, size=64,
+                  fill=steelGray, font='monospace')
         for textbox in self.textboxes:
             textbox.draw()
         for button in self.buttons:
@@ -466,8 +468,8 @@ class NewEntryForm(Form):
         super().__init__(app, w, h)
 
         if prevEntry:
-            title, username, password, seed = prevEntry[1], prevEntry[2],\
-                                        prevEntry[3], prevEntry[4]
+            title, username, password, seed = prevEntry.title, \
+                prevEntry.username, prevEntry.password, prevEntry.seed
         else:
             title, username, password, seed = '', '', '', ''
 
@@ -516,12 +518,12 @@ class NewEntryForm(Form):
                     self.buttons[5].activate()
                 ), active=False),
             Button(470, 500, 120, 40, 'Cancel',
-                   lambda: app.forms.pop(app.inFocusForm)),
+                   lambda: closeModal(app)),
             Button(610, 500, 120, 40, 'Save',
                    lambda: self.saveEntry(app))
         ]
 
-        app.forms.insert(app.inFocusForm, self)
+        app.modal = self
         self.prevEntry = prevEntry
 
     def updatePasswordGen(self, uppers=None, lowers=None, nums=None,
@@ -546,14 +548,28 @@ class NewEntryForm(Form):
         password = self.textboxes[2].text
         seed = self.textboxes[4].text # textbox 3 is password length
 
-        if self.prevEntry:
-            prevEntryID = self.prevEntry[0]
-            updateEntry(prevEntryID, title, username, password, seed,
-                        app.masterKey)
-            loadEntries(app, prevEntryID)
-        else:
-            entryID = addEntry(title, username, password, seed, app.masterKey)
-            loadEntries(app, entryID)
+        editing = self.prevEntry and self.prevEntry.id != welcomeID
+        # the key goes stale when the master password is changed from the
+        # command line while the vault is unlocked; the vault is locked, and
+        # this form is kept to be opened again once it is unlocked
+        try:
+            if editing:
+                entryID = self.prevEntry.id
+                updateEntry(entryID, title, username, password, seed,
+                            app.vaultKey)
+            else:
+                entryID = addEntry(title, username, password, seed,
+                                   app.vaultKey)
+        except StaleKeyError:
+            app.pendingForm = self
+            reset(app)
+            return
+        # close this form, leaving the view it was opened over in focus
+        closeModal(app)
+        if editing:
+            app.forms[app.inFocusForm].removeView(app)
+        EntryView.spliceEntry(app, Entry(entryID, title, username, password,
+                                         seed))
 
 class ConfirmationDialogue(Form):
     def __init__(self, app, w, h, action):
@@ -561,15 +577,15 @@ class ConfirmationDialogue(Form):
 
         self.buttons = [
             Button(290, 320, 100, 40, 'No',
-                   lambda: app.forms.pop(app.inFocusForm)),
+                   lambda: closeModal(app)),
             Button(410, 320, 100, 40, 'Yes',
                 lambda: (
-                    app.forms.pop(app.inFocusForm),
+                    closeModal(app),
                     action()
                 ))
         ]
 
-        app.forms.insert(app.inFocusForm, self)
+        app.modal = self
 
     def draw(self):
         drawRect(0, 0, 800, 600, fill='black', opacity=75)
@@ -583,7 +599,9 @@ class UnlockForm(Form):
     def __init__(self, app, w, h):
         super().__init__(app, w, h)
 
-        self.firstUse = True if getEntries('') == None else False
+        self.firstUse = isVaultEmpty()
+        # an agent holding this vault can unlock it without the master key
+        self.agentRunning = not self.firstUse and agent.isRunning()
         buttonContent = 'Start' if self.firstUse else 'Unlock'
 
         self.buttons = [
@@ -601,9 +619,13 @@ class UnlockForm(Form):
         ]
         self.inFocusTB = 0
 
+    # the only KDF run of the session happens in a worker, and onStep
+    # picks up what it sends (see pollUnlock)
     def unlock(self, app):
-        app.masterKey = self.textboxes[0].text
-        loadEntries(app)
+        if app.unlockTask == None:
+            masterKey = self.textboxes[0].text
+            app.unlockTask = UnlockTask(masterKey, useAgent=(
+                                self.agentRunning and masterKey == ''))
 
     def hidePassword(self):
         self.textboxes[0].hide = not self.textboxes[0].hide
@@ -616,166 +638,432 @@ class UnlockForm(Form):
             message = 'Enter your master password'
         drawLabel(message, 400, 225, fill=steelGray, size=26,
                   font='monospace')
+        if self.agentRunning:
+            drawLabel('or leave it empty to unlock with the running agent',
+                      400, 430, fill='dimGray', size=fontSize-4,
+                      font='monospace')
         for button in self.buttons:
             button.draw()
         for textbox in self.textboxes:
             textbox.draw()
-        if hasattr(app, 'incorrectKeyCounter') and app.incorrectKeyCounter:
+        if app.unlockTask:
+            # a new vault first times the KDF to pick its cost (see kdf.py)
+            message = 'Tuning the key derivation...' if self.firstUse \
+                      else 'Unlocking...'
+            drawLabel(message, app.width/2, app.height*0.93,
+                      fill=steelGray, size=fontSize, font='monospace')
+        elif app.incorrectKeyTimer and app.incorrectKeyTimer.isPending():
             drawLabel(f'Incorrect master key. Please try again.',
                       app.width/2, app.height*0.93, fill=steelGray,
                       size=fontSize, font='monospace')
+        elif app.unlockErrorTimer and app.unlockErrorTimer.isPending():
+            drawLabel(f'Could not unlock: {app.unlockError}'[:60],
+                      app.width/2, app.height*0.93, fill=steelGray,
+                      size=fontSize, font='monospace')
+        elif app.pendingForm:
+            drawLabel('The master password changed. Unlock to save the entry.',
+                      app.width/2, app.height*0.93, fill=steelGray,
+                      size=fontSize, font='monospace')
 
-def loadEntries(app, focusEntryID=0):
-    app.forms = []
-    entries = getEntries(app.masterKey)
-    if entries == False:
-        reset(app)
-        app.incorrectKeyCounter = 5 # 5-second decryption failure message
-        return
-    elif entries == None:
-        EntryView(app, app.width, app.height, (-1, 'Welcome!',
-                  'Click the + to add your first entry...', 'Enjoy :)', ''))
+# entry batches applied per step, so a large vault streams in over several
+# frames instead of freezing one
+unlockBatchesPerStep = 2
+
+# apply what the unlock worker has sent since the last step; the vault
+# can be browsed as soon as the first batch is in
+def pollUnlock(app):
+    for message in app.unlockTask.poll(unlockBatchesPerStep):
+        if message[0] == 'incorrectKey':
+            reset(app)
+            showIncorrectKey(app)
+            return
+        elif message[0] == 'error':
+            # like a locked database while the CLI writes to it; the app
+            # stays up so the unlock can be tried again
+            reset(app)
+            showUnlockError(app, message[1])
+            return
+        elif message[0] == 'unlocked':
+            app.vaultKey = message[1]
+            app.revealedForms = set()
+            app.searchIndex.wipe()
+        elif message[0] == 'entries':
+            addUnlockedEntries(app, message[1])
+        elif message[0] == 'corrupt':
+            app.corruptEntryIDs.extend(message[1])
+        elif message[0] == 'done':
+            if type(app.forms) != FormList:
+                app.forms = FormList(app, [])
+                app.forms.insert(getWelcomeEntry())
+                EntryView.focusForm(app, 0)
+                app.floatingForm = FloatingForm(app, app.width, app.height)
+            app.unlockTask = None
+            if app.pendingForm:
+                reopenPendingForm(app)
+
+# open the entry form that a stale key stopped from saving again, with the
+# entry it edits in focus, or as a new entry if that one is gone
+def reopenPendingForm(app):
+    form = app.pendingForm
+    app.pendingForm = None
+    entry = form.prevEntry
+    if entry and entry.id != welcomeID:
+        if entry.id in app.forms.ids:
+            EntryView.focusForm(app, app.forms.ids.index(entry.id))
+        else:
+            form.prevEntry = None
+    app.modal = form
+
+# add a batch of (id, title, sealed, username) entries, keeping the focus on
+# the same entry; titles and usernames go into the search index, the rest
+# into the store as it is, and decrypting it is left for EntryView.reveal
+@profiler.timed('addUnlockedEntries')
+def addUnlockedEntries(app, entries):
+    app.searchIndex.addMany([(entry[0], entry[1], entry[3])
+                             for entry in entries])
+    if type(app.forms) != FormList:
+        app.forms = FormList(app, entries)
+        focusIndex = len(app.forms)//2
+        app.floatingForm = FloatingForm(app, app.width, app.height)
     else:
-        for entry in entries:
-            EntryView(app, app.width, app.height, entry)
-        app.forms.sort(key=lambda form: form.entry[1].lower())
-        app.inFocusForm = len(app.forms)//2
-        for i in range(len(app.forms)):
-            if app.forms[i].entry[0] == focusEntryID:
-                app.inFocusForm = i
-                break
-    app.floatingForm = FloatingForm(app, app.width, app.height)
+        focusedID = app.forms.ids[app.inFocusForm]
+        focusedTitle = app.forms.titles[app.inFocusForm]
+        app.forms.extend(entries)
+        focusIndex = app.forms.find(focusedID, focusedTitle)
+    # only the focused view and its neighbours get built, and new neighbours
+    # get revealed
+    EntryView.focusForm(app, focusIndex)
 
 def reset(app):
     app.inspectorEnabled = False
-    app.stepsPerSecond = 60
-    app.steps = 0
-    app.keyHoldSpeed = app.stepsPerSecond//8 # 8 presses a second
-    app.keyHoldCounter = 0
+    # the app steps at the full rate while it is being used, and drops to the
+    # idle rate once the model has not changed for idleDelay seconds
+    app.activeStepsPerSecond = 60
+    app.idleStepsPerSecond = 4 # enough for the blink and 1-second timers
+    app.idleDelay = 2
+    app.stepsPerSecond = app.activeStepsPerSecond
+    app.lastActivity = time.monotonic()
+    app.frameState = None
+    app.blinkOn = False
+    app.keyRepeatDelay = 1/8 # 8 presses a second
+    app.nextKeyRepeat = 0
     app.clipboardTime = 10 # 10 seconds
-    app.clipboardCounter = 0
     app.idleTime = 60 # 1 minute (annoying but good for demonstration)
-    app.idleCounter = app.idleTime
-
-    app.masterKey = ''
+    app.lastInput = time.monotonic()
+    # the clipboard timer is left running so a copied password still gets
+    # cleared after the vault locks
+    for timer in [app.idleTimer, app.totpTimer, app.incorrectKeyTimer,
+                  app.unlockErrorTimer]:
+        if timer:
+            timer.cancel()
+    app.idleTimer = app.scheduler.scheduleAt(app.lastInput + app.idleTime,
+                                             lambda: checkIdle(app))
+    app.totpTimer = None
+    app.incorrectKeyTimer = None
+    app.unlockErrorTimer = None
+
+    if app.unlockTask:
+        app.unlockTask.cancel()
+    app.unlockTask = None
+    app.vaultKey = None
+    # decoded TOTP seeds and keys unwrapped mid-rotation are secrets too
+    totpEngine.clear()
+    clearKeys()
+    if type(app.forms) == FormList:
+        app.forms.wipe()
+    app.revealedForms = set()
+    app.searchIndex.wipe()
+    # IDs of entries the unlock left out because they did not decrypt
+    app.corruptEntryIDs = []
     app.forms = [UnlockForm(app, app.width, app.height)]
     app.inFocusForm = 0
+    app.modal = None
 
 def onAppStart(app):
+    # the checker hashes the whole app state before and after every frame,
+    # which costs more than drawing once the vault is large
+    app.disableMvcChecker = True
+    # every timer in the app is a deadline in this scheduler
+    app.scheduler = Scheduler()
+    app.clipboardTimer = None
+    app.idleTimer = None
+    app.totpTimer = None
+    app.incorrectKeyTimer = None
+    app.unlockErrorTimer = None
+    app.unlockTask = None
+    # an entry form whose save found the key stale, kept across the lock
+    app.pendingForm = None
+    app.forms = None
+    # reset wipes the index rather than dropping it
+    app.searchIndex = SearchIndex()
+    # the performance overlay (control+O) is separate from the cmu_graphics
+    # inspector, which reset keeps off so the control shortcuts work, and it
+    # stays on across locks so unlocking can be measured
+    app.overlayEnabled = False
+    app.profileSavedTimer = None
     reset(app)
 
-def redrawAll(app):
-    form = app.forms[app.inFocusForm]
-    if type(form) == EntryView:
-        form.draw()
-        app.floatingForm.draw(app)
-    elif type(form) == UnlockForm:
-        form.draw(app)
+# clear the clipboard clipboardTime seconds after the last copy
+def startClipboardTimer(app):
+    if app.clipboardTimer:
+        app.clipboardTimer.cancel()
+    app.clipboardTimer = app.scheduler.schedule(app.clipboardTime,
+                                                lambda: pyperclip.copy(''))
+
+# lock the vault once there has been no input for idleTime seconds; input
+# only moves app.lastInput, and the timer moves itself up to it when it fires
+def checkIdle(app):
+    idleDeadline = app.lastInput + app.idleTime
+    if time.monotonic() >= idleDeadline:
+        reset(app)
     else:
-        app.forms[app.inFocusForm+1].draw()
-        app.floatingForm.draw(app)
-        form.draw()
-    if 0 < app.steps % app.stepsPerSecond < app.stepsPerSecond//2:
-        if type(form) in [NewEntryForm, UnlockForm]:
-            form.textboxes[form.inFocusTB].blinkCursor()
+        app.idleTimer = app.scheduler.scheduleAt(idleDeadline,
+                                                 lambda: checkIdle(app))
+
+# the form taking input: an open dialogue, or else the form in focus
+def getFocusedForm(app):
+    return app.modal if app.modal else app.forms[app.inFocusForm]
+
+def closeModal(app):
+    app.modal = None
+
+def showIncorrectKey(app):
+    # 5-second decryption failure message
+    app.incorrectKeyTimer = app.scheduler.schedule(5, lambda: None)
+
+def showUnlockError(app, error):
+    # 5-second message for an unlock that failed for any other reason
+    app.unlockError = str(error) or type(error).__name__
+    app.unlockErrorTimer = app.scheduler.schedule(5, lambda: None)
+
+# refresh the TOTP codes of the revealed views and schedule the next refresh
+# for the moment the first of their periods rolls over
+def refreshTOTP(app):
+    if app.totpTimer:
+        app.totpTimer.cancel()
+    timeLeft = None
+    for form in app.revealedForms:
+        seed = form.entry.seed
+        if seed:
+            form.textboxes[2].text = generateTOTP(seed)
+            seedTimeLeft = totpEngine.getTimeLeft(seed)
+            timeLeft = seedTimeLeft if timeLeft == None \
+                       else min(timeLeft, seedTimeLeft)
+    app.totpTimer = app.scheduler.schedule(timeLeft, lambda: refreshTOTP(app)) \
+                    if timeLeft != None else None
+
+# a warning for as long as the vault is unlocked, since the key checked out
+# and the left-out entries were changed by something other than SteelPass
+def drawCorruptEntries(app):
+    ids = ', '.join(map(str, app.corruptEntryIDs[:5]))
+    if len(app.corruptEntryIDs) > 5:
+        ids += ', ...'
+    drawLabel(f'{len(app.corruptEntryIDs)} entries failed their integrity '
+              f'check and were left out (IDs {ids})', app.width/2,
+              app.height-15, fill='crimson', size=fontSize-6,
+              font='monospace')
+
+# a bar across the top while entries are still being decrypted
+def drawUnlockProgress(app):
+    task = app.unlockTask
+    drawRect(0, 0, app.width * task.loaded / task.total, 4, fill=steelGray)
+    drawLabel(f'Decrypting entries {task.loaded}/{task.total}',
+              app.width/2, 80, fill=steelGray, size=fontSize-4,
+              font='monospace')
+
+# spans shown in the overlay besides the frame time
+overlaySpans = 8
+profilePath = 'steelpass-profile.json'
+
+# recording only happens while the overlay is shown
+def toggleOverlay(app):
+    app.overlayEnabled = not app.overlayEnabled
+    profiler.enabled = app.overlayEnabled
+
+# control+J writes every histogram to profilePath for a bug report
+def dumpProfile(app):
+    profiler.dump(profilePath)
+    app.profileSavedTimer = app.scheduler.schedule(3, lambda: None)
+
+def drawOverlay(app):
+    lines = []
+    frame = profiler.histograms.get('redrawAll')
+    if frame:
+        stats = frame.getStats()
+        lines.append(f"frame    p50 {stats['p50']:.2f}  p95 {stats['p95']:.2f}"
+                     f"  max {stats['max']:.2f} ms")
+    lines.append(f'steps/s  {app.stepsPerSecond}')
+    lines.append(f"{'span':<26}{'p50':>8}{'p95':>8}{'max':>9}")
+    for name, stats in profiler.getSlowest(overlaySpans):
+        lines.append(f"{name:<26}{stats['p50']:8.2f}{stats['p95']:8.2f}"
+                     f"{stats['max']:9.2f}")
+    if app.profileSavedTimer and app.profileSavedTimer.isPending():
+        lines.append(f'saved {profilePath}')
+    else:
+        lines.append(f'control+J saves {profilePath}')
+    drawRect(0, 0, app.width, 12 + 16*len(lines), fill='black', opacity=85)
+    for i in range(len(lines)):
+        drawLabel(lines[i], 10, 14 + 16*i, align='left', fill='white',
+                  size=12, font='monospace')
+
+# the parts of the model shown on screen, so changes that happen without an
+# input event (like a TOTP rollover) also count as activity; the blink and
+# the clipboard countdown are left out since they change at most twice a
+# second, which the idle step rate already draws
+def getFrameState(app):
+    form = getFocusedForm(app)
+    forms = [form]
+    if type(form) != UnlockForm:
+        forms.append(app.floatingForm)
+    textboxes = [textbox for shown in forms
+                 for textbox in getattr(shown, 'textboxes', [])]
+    buttons = [button for shown in forms for button in shown.buttons]
+    return (len(app.forms), app.inFocusForm, id(form),
+            tuple((id(textbox), textbox.version, textbox.cursorIndex)
+                  for textbox in textboxes),
+            tuple(button.hover for button in buttons))
+
+# go back to the full step rate after input or a change to the model
+def wakeUp(app):
+    app.lastActivity = time.monotonic()
+    if app.stepsPerSecond != app.activeStepsPerSecond:
+        app.stepsPerSecond = app.activeStepsPerSecond
+
+def redrawAll(app):
+    with profiler.span('redrawAll'):
+        form = getFocusedForm(app)
+        if type(form) == UnlockForm:
+            form.draw(app)
         else:
-            app.floatingForm.textboxes[0].blinkCursor()
-    if app.clipboardCounter:
-        drawLabel(f'Clearing the clipboard in {app.clipboardCounter} seconds...'
-                  , app.width/2, app.height*0.93, fill=steelGray, size=fontSize,
-                  font='monospace')
+            # a dialogue is drawn over the view it was opened from
+            app.forms[app.inFocusForm].draw()
+            app.floatingForm.draw(app)
+            if app.modal:
+                form.draw()
+        if app.blinkOn:
+            if type(form) in [NewEntryForm, UnlockForm]:
+                form.textboxes[form.inFocusTB].blinkCursor()
+            else:
+                app.floatingForm.textboxes[0].blinkCursor()
+        if app.clipboardTimer and app.clipboardTimer.isPending():
+            secondsLeft = app.clipboardTimer.getSecondsLeft()
+            drawLabel(f'Clearing the clipboard in {secondsLeft} seconds...',
+                      app.width/2, app.height*0.93, fill=steelGray,
+                      size=fontSize, font='monospace')
+        if app.unlockTask and app.unlockTask.total:
+            drawUnlockProgress(app)
+        if app.corruptEntryIDs and type(form) != UnlockForm:
+            drawCorruptEntries(app)
+        if app.overlayEnabled:
+            drawOverlay(app)
 
 def onStep(app):
-    app.steps += 1
-    if app.keyHoldCounter:
-        app.keyHoldCounter -= 1
-    if app.steps % 60 == 0:
-        if app.clipboardCounter:
-            app.clipboardCounter -= 1
-            if app.clipboardCounter == 0:
-                pyperclip.copy('')
-        app.idleCounter -= 1
-        if app.idleCounter == 0:
-            reset(app)
-        if hasattr(app, 'incorrectKeyCounter') and app.incorrectKeyCounter:
-            app.incorrectKeyCounter -= 1
-        form = app.forms[app.inFocusForm]
-        if type(form) == EntryView:
-            if form.textboxes[2].text:
-                form.textboxes[2].text = generateTOTP(form.entry[4])
+    with profiler.span('onStep'):
+        now = time.monotonic()
+        # the cursor shows for the first half of every second
+        app.blinkOn = now % 1 < 0.5
+        # only the timers that are due cost anything
+        app.scheduler.runDue(now)
+        if app.unlockTask:
+            pollUnlock(app)
+        frameState = getFrameState(app)
+        if frameState != app.frameState:
+            app.frameState = frameState
+            wakeUp(app)
+        # keep polling at the full rate until the unlock is done
+        elif app.stepsPerSecond != app.idleStepsPerSecond \
+        and app.unlockTask == None and now - app.lastActivity > app.idleDelay:
+            app.stepsPerSecond = app.idleStepsPerSecond
 
 def onKeyHold(app, keys):
-    form = app.forms[app.inFocusForm]
-    if type(form) == ConfirmationDialogue:
-        return
-    if type(form) == EntryView:
-        form = app.floatingForm
-    if app.keyHoldCounter == 0:
-        if 'backspace' in keys:
-            form.textboxes[form.inFocusTB].erase()
-        elif 'right' in keys:
-            form.textboxes[form.inFocusTB].shiftCursor(1)
-        elif 'left' in keys:
-            form.textboxes[form.inFocusTB].shiftCursor(-1)
-        app.keyHoldCounter = app.keyHoldSpeed
+    with profiler.span('onKeyHold'):
+        wakeUp(app)
+        form = getFocusedForm(app)
+        if type(form) == ConfirmationDialogue:
+            return
+        if type(form) == EntryView:
+            form = app.floatingForm
+        now = time.monotonic()
+        if now >= app.nextKeyRepeat:
+            if 'backspace' in keys:
+                form.textboxes[form.inFocusTB].erase()
+            elif 'right' in keys:
+                form.textboxes[form.inFocusTB].shiftCursor(1)
+            elif 'left' in keys:
+                form.textboxes[form.inFocusTB].shiftCursor(-1)
+            app.nextKeyRepeat = now + app.keyRepeatDelay
 
 def onKeyPress(app, key, modifiers):
-    app.idleCounter = app.idleTime
-    form = app.forms[app.inFocusForm]
-    if type(form) == ConfirmationDialogue:
-        return
-    if key in 'Cc' and 'control' in modifiers and type(form) == EntryView:
-        pyperclip.copy(form.textboxes[1].text)
-        app.clipboardCounter = app.clipboardTime
-        return
-    elif key in 'Vv' and 'control' in modifiers:
-        form.textboxes[form.inFocusTB].write(pyperclip.paste())
-        return
-    if type(form) == EntryView:
-        if key == 'right':
-            EntryView.changeFormView(app, 1)
-        if key == 'left':
-            EntryView.changeFormView(app, -1)
-        form = app.floatingForm
-    if type(form) == UnlockForm:
-        if key == 'enter':
-            form.unlock(app)
-    if key == 'backspace':
-            app.keyHoldCounter = 0
-    elif key == 'tab':
-        if 'shift' in modifiers:
-            form.inFocusTB -= 1 if form.inFocusTB > 0 else 0
-        else:
-            form.inFocusTB += 1 if form.inFocusTB < len(form.textboxes)-1 else 0
-    elif key == 'space':
-        form.textboxes[form.inFocusTB].write(' ')
-    elif key in string.printable:
-        form.textboxes[form.inFocusTB].write(key)
-        if type(form) == FloatingForm:
-            EntryView.searchEntries(app, form.textboxes[form.inFocusTB].text)
+    with profiler.span('onKeyPress'):
+        wakeUp(app)
+        app.lastInput = time.monotonic()
+        form = getFocusedForm(app)
+        if key in 'Oo' and 'control' in modifiers:
+            toggleOverlay(app)
+            return
+        elif key in 'Jj' and 'control' in modifiers:
+            dumpProfile(app)
+            return
+        if type(form) == ConfirmationDialogue:
+            return
+        if key in 'Cc' and 'control' in modifiers and type(form) == EntryView:
+            pyperclip.copy(form.textboxes[1].text)
+            startClipboardTimer(app)
+            return
+        elif key in 'Vv' and 'control' in modifiers:
+            form.textboxes[form.inFocusTB].write(pyperclip.paste())
+            return
+        if type(form) == EntryView:
+            if key == 'right':
+                EntryView.changeFormView(app, 1)
+            if key == 'left':
+                EntryView.changeFormView(app, -1)
+            form = app.floatingForm
+        if type(form) == UnlockForm:
+            if key == 'enter':
+                form.unlock(app)
+        if key == 'backspace':
+                app.nextKeyRepeat = 0
+        elif key == 'tab':
+            if 'shift' in modifiers:
+                form.inFocusTB -= 1 if form.inFocusTB > 0 else 0
+            else:
+                form.inFocusTB += \
+                    1 if form.inFocusTB < len(form.textboxes)-1 else 0
+        elif key == 'space':
+            form.textboxes[form.inFocusTB].write(' ')
+        elif key in string.printable:
+            form.textboxes[form.inFocusTB].write(key)
+            if type(form) == FloatingForm:
+                EntryView.searchEntries(app,
+                                        form.textboxes[form.inFocusTB].text)
 
 def onMousePress(app, mouseX, mouseY):
-    app.idleCounter = app.idleTime
-    form = app.forms[app.inFocusForm]
-    for button in form.buttons:
-        button.checkMouseClick(mouseX, mouseY)
-    if type(form) in [NewEntryForm, UnlockForm]:
-        for i in range(len(form.textboxes)):
-            if form.textboxes[i].checkMouseClick(mouseX, mouseY):
-                form.inFocusTB = i
-    elif type(form) == EntryView:
-        for button in app.floatingForm.buttons:
+    with profiler.span('onMousePress'):
+        wakeUp(app)
+        app.lastInput = time.monotonic()
+        form = getFocusedForm(app)
+        for button in form.buttons:
             button.checkMouseClick(mouseX, mouseY)
-        for textbox in app.floatingForm.textboxes:
-            textbox.checkMouseClick(mouseX, mouseY)
+        if type(form) in [NewEntryForm, UnlockForm]:
+            for i in range(len(form.textboxes)):
+                if form.textboxes[i].checkMouseClick(mouseX, mouseY):
+                    form.inFocusTB = i
+        elif type(form) == EntryView:
+            for button in app.floatingForm.buttons:
+                button.checkMouseClick(mouseX, mouseY)
+            for textbox in app.floatingForm.textboxes:
+                textbox.checkMouseClick(mouseX, mouseY)
 
 def onMouseMove(app, mouseX, mouseY):
-    form = app.forms[app.inFocusForm]
-    for button in form.buttons:
-        button.hover = button.checkBounds(mouseX, mouseY)
-    if type(form) == EntryView:
-        for button in app.floatingForm.buttons:
+    with profiler.span('onMouseMove'):
+        wakeUp(app)
+        form = getFocusedForm(app)
+        for button in form.buttons:
             button.hover = button.checkBounds(mouseX, mouseY)
+        if type(form) == EntryView:
+            for button in app.floatingForm.buttons:
+                button.hover = button.checkBounds(mouseX, mouseY)
 
 createDB()
-runApp(width=800, height=600)
\ No newline at end of file
+runApp(width=800, height=600)
@@ -0,0 +1,134 @@
+import os
+import string
+import mmap
+import math
+import secrets
+from array import array
+
+# a list of passphrase words, one per line, that is memory-mapped on first use
+# and indexed by the byte offsets of its words, so a random word is picked in
+# O(1) without ever building a list of strings
+class Wordlist:
+    def __init__(self, path):
+        self.path = path
+        self.data = None
+        # start and end byte offsets of every non-blank line
+        self.starts = array('Q')
+        self.ends = array('Q')
+
+    def load(self):
+        if self.data != None:
+            return
+        with open(self.path, 'rb') as file:
+            size = os.fstat(file.fileno()).st_size
+            # the mapping stays valid after the file is closed
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) \
+                        if size else b''
+        start = 0
+        while start < size:
+            end = self.data.find(b'\n', start)
+            if end < 0:
+                end = size
+            if self.data[start:end].strip():
+                self.starts.append(start)
+                self.ends.append(end)
+            start = end + 1
+
+    def __len__(self):
+        self.load()
+        return len(self.starts)
+
+    def __getitem__(self, index):
+        self.load()
+        line = self.data[self.starts[index]:self.ends[index]].decode('utf-8')
+        # EFF-style lists put the dice roll and a tab before each word
+        return line.split('\t')[-1].strip()
+
+    def getRandomWord(self):
+        return self[secrets.randbelow(len(self))]
+
+    # the entropy each randomly picked word adds to a passphrase
+    def getBitsPerWord(self):
+        return math.log2(len(self)) if len(self) else 0
+
+# wordlists by path, so each file is only mapped and indexed once
+wordlists = {}
+# the bundled list, found next to this file so the CLI works from anywhere
+passphraseWordlist = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                  'lotsofwords.txt')
+
+def getWordlist(path=passphraseWordlist):
+    if path not in wordlists:
+        wordlists[path] = Wordlist(path)
+    return wordlists[path]
+
+# the character classes and length a generated password should have; with
+# passphrase set, length counts words from the wordlist instead
+class PasswordPolicy:
+    def __init__(self, length=16, uppers=True, lowers=True, nums=True,
+                 specials=True, passphrase=False, wordlist=passphraseWordlist):
+        self.length = length
+        self.uppers = uppers
+        self.lowers = lowers
+        self.nums = nums
+        self.specials = specials
+        self.passphrase = passphrase
+        self.wordlist = wordlist
+
+    # the enabled character classes, each as a string of its characters
+    def getClasses(self):
+        classes = [(self.uppers, string.ascii_uppercase),
+                   (self.lowers, string.ascii_lowercase),
+                   (self.nums, string.digits),
+                   (self.specials, string.punctuation)]
+        return [characters for enabled, characters in classes if enabled]
+
+# a bytes.translate table that maps each random byte to a character of
+# charset, with the bytes past the largest multiple of len(charset) marked
+# for deletion so that every character is equally likely
+def getSamplingTable(charset):
+    limit = 256 - 256 % len(charset)
+    table = bytes(ord(charset[byte % len(charset)]) if byte < limit else 0
+                  for byte in range(256))
+    return table, bytes(range(limit, 256))
+
+# count characters drawn uniformly from charset using the OS CSPRNG; whole
+# batches of random bytes are mapped and filtered in one translate call
+def getRandomCharacters(charset, count):
+    table, rejected = getSamplingTable(charset)
+    acceptRate = (256 - len(rejected)) / 256
+    characters = b''
+    while len(characters) < count:
+        # draw a little more than the expected need to rarely go around again
+        batch = int((count - len(characters)) / acceptRate * 1.1) + 16
+        characters += os.urandom(batch).translate(table, rejected)
+    return characters[:count].decode('ascii')
+
+# generate n passwords following policy; every password has at least one
+# character of each enabled class (when it is long enough to), which is
+# enforced by drawing again rather than by placing characters, so all
+# valid passwords stay equally likely
+def generateMany(n, policy):
+    length = policy.length
+    if policy.passphrase:
+        wordlist = getWordlist(policy.wordlist)
+        if not len(wordlist):
+            return [''] * n
+        return ['-'.join(wordlist.getRandomWord() for i in range(length))
+                for j in range(n)]
+    classes = policy.getClasses()
+    if not classes or length <= 0:
+        return [''] * n
+    charset = ''.join(classes)
+    classSets = [frozenset(characters) for characters in classes] \
+                if length >= len(classes) else []
+    passwords = []
+    while len(passwords) < n:
+        missing = n - len(passwords)
+        characters = getRandomCharacters(charset, missing * length)
+        for i in range(0, len(characters), length):
+            password = characters[i:i+length]
+            if not any(classSet.isdisjoint(password)
+                       for classSet in classSets):
+                passwords.append(password)
+    return passwords
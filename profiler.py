@@ -0,0 +1,99 @@
+# timing spans for the hot paths, kept as rolling histograms so the overlay
+# and bug reports show recent behaviour rather than a lifetime average;
+# while the profiler is off a span is a shared do-nothing context manager
+# and a timed function is one attribute check away from the original
+import time
+import json
+import functools
+import threading
+from collections import deque
+from contextlib import contextmanager, nullcontext
+
+# how many of the most recent durations each histogram keeps
+windowSize = 512
+
+# the durations of one span name, in milliseconds
+class Histogram:
+    def __init__(self):
+        self.window = deque(maxlen=windowSize)
+        self.count = 0
+
+    def add(self, ms):
+        self.window.append(ms)
+        self.count += 1
+
+    # nearest-rank p50 and p95 and the max over the window
+    def getStats(self):
+        times = sorted(self.window)
+        return {
+            'count': self.count,
+            'p50': times[len(times)//2],
+            'p95': times[min(len(times)-1, int(0.95*len(times)))],
+            'max': times[-1]
+        }
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.histograms = {}
+        self.noSpan = nullcontext()
+        # spans are recorded from worker threads too (the unlock worker's
+        # KDF and decryption), while the overlay reads them on the main one
+        self.lock = threading.Lock()
+
+    def record(self, name, ms):
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].add(ms)
+
+    @contextmanager
+    def measure(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - start) * 1000)
+
+    def span(self, name):
+        return self.measure(name) if self.enabled else self.noSpan
+
+    # decorator timing every call of a function under name
+    def timed(self, name):
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                with self.measure(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def getStats(self):
+        with self.lock:
+            return {name: histogram.getStats()
+                    for name, histogram in self.histograms.items()}
+
+    # (name, stats) of the spans with the highest p95, slowest first
+    def getSlowest(self, count):
+        stats = self.getStats()
+        names = sorted(stats, key=lambda name: stats[name]['p95'],
+                       reverse=True)
+        return [(name, stats[name]) for name in names[:count]]
+
+    def clear(self):
+        with self.lock:
+            self.histograms = {}
+
+    # everything measured so far as JSON, to attach to a bug report
+    def dump(self, path):
+        report = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'windowSize': windowSize,
+            'spans': self.getStats()
+        }
+        with open(path, 'w') as file:
+            json.dump(report, file, indent=2)
+
+profiler = Profiler()
@@ -0,0 +1,55 @@
+import time
+import math
+import heapq
+import itertools
+
+# a callback waiting in a Scheduler until its deadline
+class Timer:
+    def __init__(self, deadline, callback):
+        self.deadline = deadline
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    # a timer stops being pending once it has fired or been cancelled
+    def isPending(self):
+        return not self.cancelled
+
+    # whole seconds left until the timer fires, as shown in countdowns
+    def getSecondsLeft(self, now=None):
+        now = time.monotonic() if now == None else now
+        return max(0, math.ceil(self.deadline - now))
+
+# timers kept in a heap ordered by deadline on the monotonic clock, so
+# checking for due timers only looks at the front of the heap and a late
+# step never makes a timer drift
+class Scheduler:
+    def __init__(self):
+        self.heap = []
+        # breaks ties between equal deadlines in the order they were added
+        self.counter = itertools.count()
+
+    def scheduleAt(self, deadline, callback):
+        timer = Timer(deadline, callback)
+        heapq.heappush(self.heap, (deadline, next(self.counter), timer))
+        return timer
+
+    def schedule(self, delay, callback):
+        return self.scheduleAt(time.monotonic() + delay, callback)
+
+    # run the callbacks of every timer that is due, earliest first; a
+    # callback may schedule new timers, which also run if they are due
+    def runDue(self, now=None):
+        now = time.monotonic() if now == None else now
+        while self.heap and self.heap[0][0] <= now:
+            timer = heapq.heappop(self.heap)[2]
+            if not timer.cancelled:
+                timer.cancelled = True
+                timer.callback()
+
+    def clear(self):
+        for deadline, count, timer in self.heap:
+            timer.cancel()
+        self.heap = []
@@ -0,0 +1,162 @@
+import bisect
+import heapq
+
+# the longest n-gram stored in a SearchIndex
+gramLength = 3
+
+# every substring of text up to gramLength characters long
+def getGrams(text):
+    return {text[i:i+n] for n in range(1, gramLength+1)
+            for i in range(len(text)-n+1)}
+
+# the start and length of the shortest greedy window of text that contains
+# the characters of query in order, or None if there is none
+def findSubsequence(text, query):
+    start = text.find(query[0])
+    if start < 0:
+        return None
+    end = start
+    for char in query[1:]:
+        end = text.find(char, end+1)
+        if end < 0:
+            return None
+    return start, end-start+1
+
+# a lowercased username as the index keeps it: UTF-8 in a bytearray, which
+# wipe() can zero, rather than a string that stays in memory until it is
+# collected
+def getUsernameKey(username):
+    return bytearray((username or '').lower().encode('utf-8'))
+
+# an index over entry titles and usernames that is built once at load and
+# kept up to date as entries are saved and deleted
+class SearchIndex:
+    def __init__(self):
+        # lowercased titles, and getUsernameKey usernames, by entry ID
+        self.titles = {}
+        self.usernames = {}
+        # sorted (title, ID) pairs for prefix lookups by bisect
+        self.sortedKeys = []
+        # n-gram -> IDs of entries whose title or username contains it
+        self.grams = {}
+        # the previous query and what matched it, so a query that only grew
+        # can filter those results instead of starting over
+        self.lastQuery = None
+        self.lastMatches = None
+        self.lastFuzzyMatches = None
+
+    def add(self, entryID, title, username=None):
+        if entryID in self.titles:
+            self.remove(entryID)
+        title = title.lower()
+        username = getUsernameKey(username)
+        self.titles[entryID] = title
+        self.usernames[entryID] = username
+        bisect.insort(self.sortedKeys, (title, entryID))
+        for gram in getGrams(title) | getGrams(username.decode('utf-8')):
+            self.grams.setdefault(gram, set()).add(entryID)
+        self.lastQuery = None
+
+    # add many (entryID, title, usernameKey) entries with one sort instead
+    # of an insort each; the getUsernameKey keys are kept as they are
+    def addMany(self, entries):
+        for entryID, title, username in entries:
+            if entryID in self.titles:
+                self.remove(entryID)
+            title = title.lower()
+            self.titles[entryID] = title
+            self.usernames[entryID] = username
+            self.sortedKeys.append((title, entryID))
+            for gram in getGrams(title) | getGrams(username.decode('utf-8')):
+                self.grams.setdefault(gram, set()).add(entryID)
+        self.sortedKeys.sort()
+        self.lastQuery = None
+
+    def remove(self, entryID):
+        title = self.titles.pop(entryID)
+        username = self.usernames.pop(entryID)
+        self.sortedKeys.pop(bisect.bisect_left(self.sortedKeys,
+                                               (title, entryID)))
+        for gram in getGrams(title) | getGrams(username.decode('utf-8')):
+            self.grams[gram].discard(entryID)
+            if not self.grams[gram]:
+                del self.grams[gram]
+        username[:] = bytes(len(username))
+        self.lastQuery = None
+
+    # zero every username and empty the index, when the vault locks
+    def wipe(self):
+        for username in self.usernames.values():
+            username[:] = bytes(len(username))
+        self.__init__()
+
+    # IDs of entries containing every gram, smallest set first
+    def lookupGrams(self, grams):
+        sets = sorted((self.grams.get(gram, set()) for gram in grams), key=len)
+        return set.intersection(*sets) if sets else set()
+
+    def getPrefixMatches(self, query):
+        start = bisect.bisect_left(self.sortedKeys, (query,))
+        # the smallest string greater than every title starting with query
+        upperBound = query[:-1] + chr(ord(query[-1])+1)
+        end = bisect.bisect_left(self.sortedKeys, (upperBound,))
+        return [entryID for title, entryID in self.sortedKeys[start:end]]
+
+    # lower keys rank higher: title matches beat username matches, earlier
+    # and word-starting matches beat later ones, and exact substrings beat
+    # fuzzy (in-order but scattered) characters
+    def getRank(self, entryID, query):
+        title = self.titles[entryID]
+        usernameQuery = query.encode('utf-8')
+        position = title.find(query)
+        if position > 0:
+            wordStart = title[position-1] in ' -_.@'
+            return (1 if wordStart else 2, position, title)
+        username = self.usernames[entryID]
+        position = username.find(usernameQuery)
+        if position >= 0:
+            return (3, position, title)
+        match = findSubsequence(title, query)
+        if match:
+            return (4, match[1], title)
+        return (5, findSubsequence(username, usernameQuery)[1], title)
+
+    # return the IDs of matching entries, best match first
+    def search(self, query, limit=None):
+        query = query.lower()
+        if not query:
+            return []
+        if self.lastQuery != None and query.startswith(self.lastQuery):
+            # both kinds of match can only shrink as a query grows
+            candidates = self.lastMatches
+            fuzzyCandidates = self.lastMatches | self.lastFuzzyMatches
+        else:
+            if len(query) <= gramLength:
+                candidates = self.grams.get(query, set())
+            else:
+                candidates = self.lookupGrams(
+                    {query[i:i+gramLength]
+                     for i in range(len(query)-gramLength+1)})
+            fuzzyCandidates = self.lookupGrams(set(query))
+        # usernames are bytes, so they are matched against the query's UTF-8
+        usernameQuery = query.encode('utf-8')
+        matches = {entryID for entryID in candidates
+                   if query in self.titles[entryID]
+                   or usernameQuery in self.usernames[entryID]}
+        fuzzyMatches = {entryID for entryID in fuzzyCandidates - matches
+                        if findSubsequence(self.titles[entryID], query)
+                        or findSubsequence(self.usernames[entryID],
+                                           usernameQuery)}
+        self.lastQuery = query
+        self.lastMatches = matches
+        self.lastFuzzyMatches = fuzzyMatches
+        # title prefix matches come first, already in alphabetical order
+        results = self.getPrefixMatches(query)
+        if limit != None and len(results) >= limit:
+            return results[:limit]
+        others = (matches - set(results)) | fuzzyMatches
+        ranked = heapq.nsmallest(limit - len(results), others,
+            key=lambda entryID: self.getRank(entryID, query)) \
+            if limit != None else \
+            sorted(others, key=lambda entryID: self.getRank(entryID, query))
+        return results + ranked
@@ -0,0 +1,383 @@
+# headless command line interface to the vault; it only imports the crypto,
+# storage and TOTP modules, never cmu_graphics or PIL, so it starts quickly
+import sys
+import os
+import argparse
+import getpass
+import vault
+import transfer
+import agent
+import kdf
+from totp import generateTOTP
+from passwords import PasswordPolicy, generateMany, getWordlist
+from profiler import profiler
+
+# scripts can pass the master password through the environment instead of
+# typing it at the prompt
+masterKeyVariable = 'STEELPASS_MASTER_KEY'
+newMasterKeyVariable = 'STEELPASS_NEW_MASTER_KEY'
+
+fields = {'username': 2, 'password': 3, 'seed': 4}
+
+def fail(message):
+    print(message, file=sys.stderr)
+    sys.exit(1)
+
+# open the vault at args.db; only commands that add entries may create it,
+# since unlocking an empty vault takes the typed password as its new master
+# password (see vault.unlockVault)
+def openVault(args, create=False):
+    if not create and not os.path.exists(args.db):
+        fail(f'There is no vault at {args.db}.')
+    vault.createDB()
+    if not create and vault.isVaultEmpty():
+        fail('The vault is empty; add or import entries first.')
+
+def unlock(args, create=False):
+    openVault(args, create)
+    # a running agent saves the KDF run
+    if not args.no_agent:
+        vaultKey = agent.getVaultKey(args.db)
+        if vaultKey:
+            return vaultKey
+    masterKey = os.environ.get(masterKeyVariable)
+    if masterKey == None:
+        masterKey = getpass.getpass('Master password: ')
+    vaultKey = vault.unlockVault(masterKey)
+    if vaultKey == False:
+        fail('Incorrect master key.')
+    return vaultKey
+
+# the result of a request to the agent, or None if there is no agent for
+# this vault and the command has to unlock it itself
+def askAgent(args, message):
+    if args.no_agent:
+        return None
+    message['db'] = args.db
+    response = agent.request(message)
+    if response == None or response.get('error') == agent.otherVaultError:
+        return None
+    if not response['ok']:
+        fail(response['error'])
+    return response['result']
+
+def findTitle(args, vaultKey):
+    entries = vault.findEntries(vaultKey, title=args.title)
+    if not entries:
+        fail(f'No entry titled {args.title!r}.')
+    return entries
+
+def listEntries(args):
+    result = askAgent(args, {'command': 'list', 'prefix': args.prefix})
+    if result != None:
+        for title, username in result:
+            print(f'{title}\t{username}')
+        return
+    vaultKey = unlock(args)
+    entries = vault.findEntries(vaultKey, titlePrefix=args.prefix)
+    entries.sort(key=lambda entry: entry[1].lower())
+    for entry in entries:
+        print(f'{entry[1]}\t{entry[2]}')
+
+def getEntry(args):
+    result = askAgent(args, {'command': 'get', 'title': args.title,
+                             'field': args.field})
+    if result != None:
+        print(*result, sep='\n')
+        return
+    vaultKey = unlock(args)
+    for entry in findTitle(args, vaultKey):
+        print(entry[fields[args.field]])
+
+def addEntry(args):
+    vaultKey = unlock(args, create=True)
+    password = args.password
+    if password == None:
+        password = getpass.getpass('Password (leave empty to generate): ')
+    if not password:
+        password = generateMany(1, PasswordPolicy(args.length))[0]
+    vault.addEntry(args.title, args.username, password, args.seed, vaultKey)
+
+def showTOTP(args):
+    result = askAgent(args, {'command': 'totp', 'title': args.title})
+    if result != None:
+        print(*result, sep='\n')
+        return
+    vaultKey = unlock(args)
+    for entry in findTitle(args, vaultKey):
+        print(generateTOTP(entry[4]))
+
+def importEntries(args):
+    vaultKey = unlock(args, create=True)
+    added, skipped = transfer.importEntries(vaultKey, args.file, args.format)
+    print(f'Added {added} entries, skipped {skipped} with titles already '
+          'in the vault.', file=sys.stderr)
+
+def exportEntries(args):
+    vaultKey = unlock(args)
+    count = transfer.exportEntries(vaultKey, args.file, args.format)
+    print(f'Exported {count} entries.', file=sys.stderr)
+
+# reseal the vault under a new key, or finish the rotation in progress
+def rotateKey(args, masterKey, newMasterKey, params=None):
+    # an agent holding the old key could not read the resealed entries
+    agent.request({'command': 'lock', 'db': args.db})
+
+    def showProgress(done, total):
+        print(f'\rResealed {done}/{total} entries', end='', file=sys.stderr)
+    if vault.rotateMasterKey(masterKey, newMasterKey, progress=showProgress,
+                             params=params) == False:
+        fail('Incorrect master key.')
+    print(file=sys.stderr)
+
+# the master password for a rotation, which can't come from the agent
+def askMasterKey():
+    masterKey = os.environ.get(masterKeyVariable)
+    if masterKey == None:
+        masterKey = getpass.getpass('Master password: ')
+    return masterKey
+
+def changeMasterKey(args):
+    openVault(args)
+    masterKey = askMasterKey()
+    newMasterKey = None
+    if vault.isRotating():
+        print('Resuming the unfinished change of the master password.',
+              file=sys.stderr)
+    else:
+        newMasterKey = os.environ.get(newMasterKeyVariable)
+        if newMasterKey == None:
+            newMasterKey = getpass.getpass('New master password: ')
+            if getpass.getpass('Repeat it: ') != newMasterKey:
+                fail('The passwords do not match.')
+        if not newMasterKey:
+            fail('The master password cannot be empty.')
+    rotateKey(args, masterKey, newMasterKey)
+
+# show the key derivation of the vault and how long it takes here, or with
+# --tune pick new parameters and reseal the vault with the same password
+def tuneKDF(args):
+    openVault(args)
+    metadata = vault.getMetadata()
+    params = kdf.getParams(metadata)
+    print(f'{kdf.describeParams(params)}, '
+          f'{kdf.measureKdf(params):.0f} ms on this machine')
+    if vault.isRotating():
+        params = kdf.getParams(metadata, 'next')
+        print(f'changing to {kdf.describeParams(params)}; run '
+              "'kdf --tune' or 'passwd' again to finish")
+    if not args.tune:
+        return
+    masterKey = askMasterKey()
+    if vault.isRotating():
+        rotateKey(args, masterKey, None)
+        return
+    # check the password before spending time on the calibration
+    if vault.unlockVault(masterKey) == False:
+        fail('Incorrect master key.')
+    if args.iterations or args.cost:
+        try:
+            params = kdf.makeParams(args.function, args.iterations,
+                                    args.cost, args.block_size,
+                                    args.parallelism)
+        except ValueError as error:
+            fail(f'Invalid key derivation parameters: {error}.')
+    else:
+        params = kdf.calibrate(args.function, args.target_ms,
+                               args.block_size, args.parallelism)
+    print(f'tuning to {kdf.describeParams(params)}, '
+          f'{kdf.measureKdf(params):.0f} ms on this machine', file=sys.stderr)
+    rotateKey(args, masterKey, masterKey, params)
+
+# show whether the blind index is on, or turn it on (building its tokens
+# for every entry) or off
+def manageIndex(args):
+    if args.rebuild:
+        vaultKey = unlock(args)
+        vault.rebuildBlindIndex(vaultKey)
+    elif args.disable:
+        openVault(args)
+        vault.disableBlindIndex()
+    else:
+        openVault(args)
+    print('The blind index is ' +
+          ('on.' if vault.isBlindIndexEnabled() else 'off.'))
+
+def startAgent(args):
+    if agent.isRunning():
+        fail(f'An agent is already running on {agent.getSocketPath()}.')
+    vaultKey = unlock(args)
+    server = agent.Agent(vaultKey, args.db, idleTime=args.idle)
+    if not args.foreground:
+        # the child must not share the parent's SQLite connection
+        vault.store.close()
+        if os.fork() != 0:
+            print(f'Agent listening on {agent.getSocketPath()}.')
+            return
+        os.setsid()
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for stream in [0, 1, 2]:
+            os.dup2(devnull, stream)
+    server.serve()
+
+def stopAgent(args):
+    response = agent.request({'command': 'lock', 'db': args.db})
+    if response == None:
+        fail('No agent is running.')
+    if not response['ok']:
+        fail(response['error'])
+
+def showAgentStatus(args):
+    response = agent.request({'command': 'ping'})
+    if response == None:
+        fail('No agent is running.')
+    print(f"Agent on {agent.getSocketPath()} holds {response['result']}.")
+
+def generatePasswords(args):
+    policy = PasswordPolicy(args.length, not args.no_uppers,
+                            not args.no_lowers, not args.no_nums,
+                            not args.no_specials, args.passphrase)
+    for password in generateMany(args.count, policy):
+        print(password)
+    # on stderr, so the passphrases alone can still be piped somewhere
+    if args.passphrase:
+        wordlist = getWordlist(policy.wordlist)
+        print(f'{args.length} words from a list of {len(wordlist)}: '
+              f'{args.length * wordlist.getBitsPerWord():.1f} bits of '
+              'entropy each', file=sys.stderr)
+
+def getParser():
+    parser = argparse.ArgumentParser(prog='steelpass',
+        description='Read and add SteelPass entries without the GUI. The '
+                    f'master password is read from ${masterKeyVariable} '
+                    'if it is set.')
+    parser.add_argument('--db', default='entries.db',
+                        help='vault database (default: entries.db)')
+    parser.add_argument('--profile', metavar='FILE',
+                        help='write the timings of the command to FILE as '
+                             'JSON')
+    parser.add_argument('--no-agent', action='store_true',
+                        help='unlock the vault here even if an agent is '
+                             'running')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('list', help='list titles and usernames')
+    command.add_argument('prefix', nargs='?',
+                         help='only list titles starting with this')
+    command.set_defaults(run=listEntries)
+
+    command = commands.add_parser('get', help='print a field of an entry')
+    command.add_argument('title')
+    command.add_argument('--field', choices=fields, default='password')
+    command.set_defaults(run=getEntry)
+
+    command = commands.add_parser('add', help='add an entry')
+    command.add_argument('title')
+    command.add_argument('--username', default='')
+    command.add_argument('--password',
+                         help='prompted for if left out; empty generates one')
+    command.add_argument('--seed', default='', help='2FA seed')
+    command.add_argument('--length', type=int, default=16,
+                         help='length of a generated password')
+    command.set_defaults(run=addEntry)
+
+    command = commands.add_parser('totp', help='print the 2FA code of an entry')
+    command.add_argument('title')
+    command.set_defaults(run=showTOTP)
+
+    command = commands.add_parser('import',
+        help='add the entries of a CSV or JSON export, skipping titles '
+             'already in the vault')
+    command.add_argument('file', help="CSV or JSON file, or - for stdin")
+    command.add_argument('--format', choices=['csv', 'json'],
+                         help='default: from the file extension')
+    command.set_defaults(run=importEntries)
+
+    command = commands.add_parser('export',
+        help='write every entry, unencrypted, as CSV or JSON')
+    command.add_argument('file', help="CSV or JSON file, or - for stdout")
+    command.add_argument('--format', choices=['csv', 'json'],
+                         help='default: from the file extension')
+    command.set_defaults(run=exportEntries)
+
+    command = commands.add_parser('passwd',
+        help='change the master password; if it gets interrupted, run it '
+             'again with either password to finish')
+    command.set_defaults(run=changeMasterKey)
+
+    command = commands.add_parser('kdf',
+        help='show how the master password is turned into the vault key, '
+             'or change it with --tune')
+    command.add_argument('--tune', action='store_true',
+        help='reseal the vault with parameters calibrated to this machine, '
+             'or the ones given below')
+    command.add_argument('--function', choices=kdf.tunableKdfs,
+                         default=kdf.defaultKdf,
+                         help='default: %(default)s')
+    command.add_argument('--target-ms', type=int, default=kdf.targetMs,
+                         help='unlock time to calibrate for '
+                              '(default: %(default)s)')
+    command.add_argument('--iterations', type=int,
+                         help='PBKDF2 iterations instead of calibrating')
+    command.add_argument('--cost', type=int,
+                         help='scrypt N (a power of two) instead of '
+                              'calibrating')
+    command.add_argument('--block-size', type=int, default=8,
+                         help='scrypt r (default: %(default)s)')
+    command.add_argument('--parallelism', type=int, default=1,
+                         help='scrypt p (default: %(default)s)')
+    command.set_defaults(run=tuneKDF)
+
+    command = commands.add_parser('index',
+        help='show, turn on or turn off the blind index, which finds '
+             'entries by title or username without decrypting the vault')
+    action = command.add_mutually_exclusive_group()
+    action.add_argument('--rebuild', action='store_true',
+        help='make the tokens of every entry and turn the index on')
+    action.add_argument('--disable', action='store_true',
+        help='drop the tokens and go back to scanning the vault')
+    command.set_defaults(run=manageIndex)
+
+    command = commands.add_parser('agent',
+        help='keep the vault unlocked in a background process that other '
+             'commands and the GUI ask instead of running the KDF')
+    agentCommands = command.add_subparsers(dest='agentCommand',
+                                           required=True)
+    command = agentCommands.add_parser('start', help='unlock and start')
+    command.add_argument('--idle', type=int, default=agent.defaultIdleTime,
+        help='lock after this many seconds without a request '
+             '(default: %(default)s)')
+    command.add_argument('--foreground', action='store_true')
+    command.set_defaults(run=startAgent)
+    command = agentCommands.add_parser('stop', help='lock and stop')
+    command.set_defaults(run=stopAgent)
+    command = agentCommands.add_parser('status')
+    command.set_defaults(run=showAgentStatus)
+
+    command = commands.add_parser('generate', help='generate passwords')
+    command.add_argument('--count', '-n', type=int, default=1)
+    command.add_argument('--length', type=int, default=16,
+                         help='characters, or words with --passphrase')
+    command.add_argument('--no-uppers', action='store_true')
+    command.add_argument('--no-lowers', action='store_true')
+    command.add_argument('--no-nums', action='store_true')
+    command.add_argument('--no-specials', action='store_true')
+    command.add_argument('--passphrase', action='store_true')
+    command.set_defaults(run=generatePasswords)
+    return parser
+
+def main(argv=None):
+    args = getParser().parse_args(argv)
+    # the connection is only opened by commands that use the vault
+    vault.store = vault.VaultStore(args.db)
+    profiler.enabled = args.profile != None
+    with profiler.span(args.command):
+        try:
+            args.run(args)
+        except vault.CorruptEntryError as error:
+            fail(f'The vault is damaged: {error}.')
+    if args.profile:
+        profiler.dump(args.profile)
+
+if __name__ == '__main__':
+    main()
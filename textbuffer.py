@@ -0,0 +1,60 @@
+# the smallest gap left after growing, so typing a character at a time only
+# grows the buffer every so often
+minGap = 16
+
+# text kept as a list of characters with an unused gap at the edit point;
+# inserting or deleting next to the gap only touches the gap, and moving
+# the gap costs as many characters as it moves, so editing at the cursor is
+# O(1) amortized however long the text is
+class GapBuffer:
+    def __init__(self, text=''):
+        self.chars = list(text) + [''] * minGap
+        self.gapStart = len(text)
+        self.gapEnd = len(self.chars)
+
+    def __len__(self):
+        return len(self.chars) - (self.gapEnd - self.gapStart)
+
+    def __str__(self):
+        return ''.join(self.chars[:self.gapStart] + self.chars[self.gapEnd:])
+
+    def moveGap(self, index):
+        if index < self.gapStart:
+            count = self.gapStart - index
+            self.chars[self.gapEnd-count:self.gapEnd] = \
+                self.chars[index:self.gapStart]
+            self.gapStart -= count
+            self.gapEnd -= count
+        elif index > self.gapStart:
+            count = index - self.gapStart
+            self.chars[self.gapStart:index] = \
+                self.chars[self.gapEnd:self.gapEnd+count]
+            self.gapStart += count
+            self.gapEnd += count
+
+    def insert(self, index, data):
+        self.moveGap(index)
+        if len(data) > self.gapEnd - self.gapStart:
+            # at least double the buffer, so a run of inserts copies each
+            # character a constant number of times on average
+            grow = len(data) + len(self) + minGap
+            self.chars[self.gapEnd:self.gapEnd] = [''] * grow
+            self.gapEnd += grow
+        self.chars[self.gapStart:self.gapStart+len(data)] = data
+        self.gapStart += len(data)
+
+    # delete count characters starting at index
+    def delete(self, index, count=1):
+        count = max(0, min(count, len(self) - index))
+        self.moveGap(index)
+        self.gapEnd += count
+
+    # the text between start and end, without joining the rest of it
+    def getSlice(self, start, end):
+        end = min(end, len(self))
+        if start >= end:
+            return ''
+        gapSize = self.gapEnd - self.gapStart
+        before = self.chars[start:min(end, self.gapStart)]
+        after = self.chars[max(start, self.gapStart)+gapSize:end+gapSize]
+        return ''.join(before + after)
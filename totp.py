@@ -0,0 +1,116 @@
+import time
+import base64
+import hmac
+import hashlib
+import struct
+import urllib.parse
+
+# HMAC algorithms a TOTP seed can ask for
+totpAlgorithms = {'SHA1': hashlib.sha1, 'SHA256': hashlib.sha256,
+                  'SHA512': hashlib.sha512}
+
+# decodes each TOTP seed once and caches its current code, so asking for the
+# code again within the same period is a dictionary lookup
+class TOTPEngine:
+    def __init__(self):
+        # seed -> (key, hash function, digits, period), or None if unusable
+        self.seeds = {}
+        # seed -> (counter, code) for the last period a code was made in
+        self.codes = {}
+
+    def clear(self):
+        self.seeds.clear()
+        self.codes.clear()
+
+    # a seed is either a Base32 secret or an otpauth:// URI, which can also
+    # choose the algorithm (SHA1/SHA256/SHA512), digits and period
+    def parseSeed(self, seed):
+        if seed not in self.seeds:
+            try:
+                algorithm, digits, period = 'SHA1', 6, 30
+                secret = seed
+                if seed.startswith('otpauth://'):
+                    query = urllib.parse.parse_qs(
+                                urllib.parse.urlparse(seed).query)
+                    secret = query['secret'][0]
+                    algorithm = query.get('algorithm', [algorithm])[0].upper()
+                    digits = int(query.get('digits', [digits])[0])
+                    period = int(query.get('period', [period])[0])
+                secret = secret.replace(' ', '').upper()
+                # decode the Base32 seed to bytes, padding it if needed
+                key = base64.b32decode(secret + '=' * (-len(secret) % 8))
+                if not key or not 6 <= digits <= 10 or period <= 0:
+                    raise ValueError
+                self.seeds[seed] = (key, totpAlgorithms[algorithm], digits,
+                                    period)
+            except:
+                self.seeds[seed] = None
+        return self.seeds[seed]
+
+    def computeCode(self, key, hashFunction, digits, counter):
+        # pack the counter into an 8-byte big-endian value
+        counterBytes = struct.pack(">Q", counter)
+        # use HMAC to hash the counter with the seed
+        hmacHash = hmac.new(key, counterBytes, hashFunction).digest()
+        # extract a 4-byte segment from the hash
+        offset = hmacHash[-1] & 0x0F
+        # 31 bits to avoid negatives
+        code = struct.unpack(">I", hmacHash[offset:offset+4])[0] & 0x7FFFFFFF
+        # reduce to the number of digits
+        return str(code % (10 ** digits)).zfill(digits)
+
+    # the code for seed at time now (the current time by default), or None
+    # if the seed is not recognized
+    def getCode(self, seed, now=None):
+        parsed = self.parseSeed(seed)
+        if parsed == None:
+            return None
+        key, hashFunction, digits, period = parsed
+        # get the current period
+        counter = int((time.time() if now == None else now) // period)
+        cached = self.codes.get(seed)
+        if cached == None or cached[0] != counter:
+            cached = (counter, self.computeCode(key, hashFunction, digits,
+                                                counter))
+            self.codes[seed] = cached
+        return cached[1]
+
+    # the codes of many seeds at one moment
+    def getCodes(self, seeds, now=None):
+        now = time.time() if now == None else now
+        return [self.getCode(seed, now) for seed in seeds]
+
+    # the seconds until the code of seed next changes
+    def getTimeLeft(self, seed, now=None):
+        parsed = self.parseSeed(seed)
+        period = parsed[3] if parsed else 30
+        return period - (time.time() if now == None else now) % period
+
+    # check code against the periods within window steps of now, to allow
+    # for clock drift between devices
+    def verify(self, seed, code, window=1, now=None):
+        parsed = self.parseSeed(seed)
+        if parsed == None:
+            return False
+        key, hashFunction, digits, period = parsed
+        counter = int((time.time() if now == None else now) // period)
+        matched = False
+        for step in range(-window, window+1):
+            expected = self.computeCode(key, hashFunction, digits,
+                                        counter+step)
+            # compare every candidate so the timing reveals nothing
+            matched |= hmac.compare_digest(expected, str(code))
+        return matched
+
+    # check many (seed, code) pairs at one moment
+    def verifyMany(self, pairs, window=1, now=None):
+        now = time.time() if now == None else now
+        return [self.verify(seed, code, window, now) for seed, code in pairs]
+
+totpEngine = TOTPEngine()
+
+def generateTOTP(seed):
+    if not seed:
+        return ''
+    code = totpEngine.getCode(seed)
+    return code if code != None else 'Unrecognizable seed format'
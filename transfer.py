@@ -0,0 +1,248 @@
+# streaming import and export of vault entries as CSV or JSON; records are
+# read, sealed and written a batch at a time, and exports decrypt one row at
+# a time, so neither ever holds the whole vault in memory
+import csv
+import os
+import re
+import sys
+import json
+from contextlib import nullcontext
+import vault
+
+# header names used by common password managers for each field, in the
+# order they are tried; the first ones are what export writes
+fieldNames = {
+    'title': ['title', 'name'],
+    'username': ['username', 'login_username', 'login', 'user', 'email'],
+    'password': ['password', 'login_password'],
+    'seed': ['seed', 'totp', 'login_totp', 'otpauth', 'otp']
+}
+
+# rows sealed per task, and tasks read ahead per worker
+batchSize = 500
+batchesPerWorker = 4
+
+def getFormat(path, format=None):
+    if format:
+        return format
+    return 'json' if path.lower().endswith(('.json', '.jsonl')) else 'csv'
+
+# a file, or standard input or output for '-', which is left open
+def openText(path, mode):
+    if path == '-':
+        return nullcontext(sys.stdin if mode == 'r' else sys.stdout)
+    return open(path, mode, encoding='utf-8', newline='')
+
+# (title, username, password, seed) from one flat record, trying every name
+# a field goes by
+def getRecord(item):
+    item = {str(key).lower(): value for key, value in item.items()}
+    # Bitwarden keeps the credentials of an item in a nested login object
+    login = item.get('login')
+    if isinstance(login, dict):
+        item.update({f'login_{key.lower()}': value
+                     for key, value in login.items()})
+    record = []
+    for field in ['title', 'username', 'password', 'seed']:
+        value = ''
+        for name in fieldNames[field]:
+            if item.get(name):
+                value = item[name]
+                break
+        record.append(str(value))
+    return tuple(record)
+
+# the lines of a file whose first chunk has already been read
+def readLines(buffer, file):
+    lines = buffer.split('\n')
+    yield from lines[:-1]
+    # the last line of the chunk may continue in the file
+    yield lines[-1] + file.readline()
+    yield from file
+
+def readCSV(file):
+    for row in csv.DictReader(file):
+        yield getRecord(row)
+
+# the objects of the entry array of a JSON document, decoded one at a time;
+# the array is either the whole document or the value of its "items" key
+# (Bitwarden and most other exports), and JSON Lines files have one object
+# per line
+def readJSON(file, chunkSize=1<<16):
+    decoder = json.JSONDecoder()
+    buffer = file.read(chunkSize)
+    stripped = buffer.lstrip()
+    if stripped.startswith('{'):
+        # a first line that is a whole object by itself means JSON Lines
+        try:
+            item = json.loads(buffer.partition('\n')[0])
+        except json.JSONDecodeError:
+            item = None
+        if isinstance(item, dict) and 'items' not in item:
+            for line in readLines(buffer, file):
+                if line.strip():
+                    yield getRecord(json.loads(line))
+            return
+    # skip to the opening bracket of the array
+    while True:
+        match = re.search(r'^\s*\[' if stripped.startswith('[')
+                          else r'"items"\s*:\s*\[', buffer)
+        if match:
+            index = match.end()
+            break
+        chunk = file.read(chunkSize)
+        if not chunk:
+            raise ValueError('no entry array in the JSON document')
+        buffer += chunk
+    while True:
+        # skip whitespace and the commas between objects
+        while index < len(buffer) and buffer[index] in ' \t\r\n,':
+            index += 1
+        if index < len(buffer) and buffer[index] == ']':
+            return
+        try:
+            item, index = decoder.raw_decode(buffer, index)
+        except json.JSONDecodeError:
+            chunk = file.read(chunkSize)
+            if not chunk:
+                raise
+            # drop what has been decoded before growing the buffer
+            buffer = buffer[index:] + chunk
+            index = 0
+            continue
+        if isinstance(item, dict):
+            yield getRecord(item)
+
+def readRecords(file, format):
+    return readJSON(file) if format == 'json' else readCSV(file)
+
+# seal a batch of records and make their blind index tokens (runs in a
+# worker process)
+def sealRecords(vaultKey, blindIndex, records):
+    return [((vault.sealEntry(vaultKey, *record),),
+             vault.getBlindTokens(vaultKey, record[0], record[1])
+             if blindIndex else ())
+            for record in records]
+
+# the normalized titles already in the vault; with the blind index the
+# title tokens are compared instead, so nothing has to be decrypted
+def getExistingTitles(vaultKey, useTokens):
+    if useTokens:
+        return {row[0] for row in
+                vault.store.execute('SELECT token FROM blindIndex')}
+    entries = vault.getSealedEntries(vaultKey)
+    return {vault.normalizeText(entry[1]) for entry in entries}
+
+def getTitleKey(vaultKey, useTokens, title):
+    if useTokens:
+        return vault.blindToken(vaultKey, 'title', title)
+    return vault.normalizeText(title)
+
+# the next few batches of records whose titles are not taken yet
+def readBatches(records, count, isNew):
+    batches = []
+    batch = []
+    for record in records:
+        if not record[0] or not isNew(record[0]):
+            continue
+        batch.append(record)
+        if len(batch) == batchSize:
+            batches.append(batch)
+            batch = []
+            if len(batches) == count:
+                return batches
+    if batch:
+        batches.append(batch)
+    return batches
+
+# add every record of a CSV or JSON export whose title is not in the vault
+# yet (nor earlier in the file), and return (added, skipped); it all goes in
+# one transaction, so a failed import adds nothing
+def importEntries(vaultKey, path, format=None, workers=None):
+    workers = workers or os.cpu_count() or 1
+    blindIndex = vault.isBlindIndexEnabled()
+    keyVersion = vault.getKeyVersion(vaultKey)
+    # mid-rotation some tokens are under the other key, so titles are
+    # compared by decrypting them, like vault.findEntries does
+    useTokens = blindIndex and not vault.isRotating()
+    titles = getExistingTitles(vaultKey, useTokens)
+    counts = {'read': 0, 'added': 0}
+
+    def isNew(title):
+        counts['read'] += 1
+        key = getTitleKey(vaultKey, useTokens, title)
+        if key in titles:
+            return False
+        titles.add(key)
+        return True
+
+    executor = None
+    with openText(path, 'r') as file, vault.store.transaction():
+        records = readRecords(file, getFormat(path, format))
+        try:
+            while True:
+                batches = readBatches(records, workers*batchesPerWorker,
+                                      isNew)
+                if not batches:
+                    break
+                # the pool is only started once there is enough to share
+                if executor == None and workers > 1 and len(batches) > 1:
+                    # imported here like in vault.getLegacyEntries
+                    from concurrent.futures import ProcessPoolExecutor
+                    executor = ProcessPoolExecutor(max_workers=workers)
+                if executor:
+                    results = executor.map(sealRecords,
+                                           [vaultKey]*len(batches),
+                                           [blindIndex]*len(batches),
+                                           batches)
+                else:
+                    results = [sealRecords(vaultKey, blindIndex, batch)
+                               for batch in batches]
+                for sealed in results:
+                    writeBatch(sealed, keyVersion)
+                    counts['added'] += len(sealed)
+        finally:
+            if executor:
+                executor.shutdown()
+    return counts['added'], counts['read'] - counts['added']
+
+def writeBatch(sealed, keyVersion):
+    vault.store.executemany(vault.store.insertEntrySQL,
+                            [(*row, keyVersion) for row, tokens in sealed])
+    if not sealed[0][1]:
+        return
+    # rows inserted in one write transaction get consecutive IDs
+    lastID = vault.store.execute('SELECT last_insert_rowid()').fetchone()[0]
+    firstID = lastID - len(sealed) + 1
+    vault.store.executemany(vault.store.insertTokenSQL, [
+        (token, firstID + i)
+        for i in range(len(sealed)) for token in sealed[i][1]
+    ])
+
+# write every entry as CSV or JSON, decrypting one row at a time, and
+# return how many were written
+def exportEntries(vaultKey, path, format=None):
+    format = getFormat(path, format)
+    names = [fieldNames[field][0]
+             for field in ['title', 'username', 'password', 'seed']]
+    count = 0
+    with openText(path, 'w') as file:
+        if format == 'csv':
+            writer = csv.writer(file)
+            writer.writerow(names)
+        else:
+            file.write('[')
+        for row in vault.store.iterRows():
+            entry = vault.openRow(vaultKey, row)
+            if entry == False:
+                vault.raiseUnreadable(vaultKey, row[0])
+            entry = entry[1:]
+            if format == 'csv':
+                writer.writerow(entry)
+            else:
+                file.write(',\n ' if count else '\n ')
+                json.dump(dict(zip(names, entry)), file)
+            count += 1
+        if format == 'json':
+            file.write('\n]\n')
+    return count
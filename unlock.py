@@ -0,0 +1,80 @@
+# unlocking in a worker thread, so the KDF and the decryption of a large
+# vault never block the event loop; the worker posts messages that the
+# caller polls for:
+#     ('incorrectKey',)                       wrong key, nothing else follows
+#     ('unlocked', vaultKey, entryCount)      the key checked out
+#     ('entries', [(id, title, sealed, username), ...])
+#                                             the next batch of entries
+#     ('corrupt', [id, ...])                  entries that failed their
+#                                             integrity check, left out
+#     ('done',)                               every entry has been sent
+#     ('error', exception)                    anything else went wrong
+import queue
+import threading
+import vault
+import agent
+
+class UnlockTask:
+    # with useAgent the vault key comes from a running agent (see agent.py)
+    # instead of the master key
+    def __init__(self, masterKey, batchSize=500, useAgent=False):
+        self.batchSize = batchSize
+        self.useAgent = useAgent
+        self.messages = queue.Queue()
+        self.cancelled = False
+        # entries sent so far and in total, for a progress indicator
+        self.loaded = 0
+        self.total = None
+        # a daemon, so quitting mid-unlock doesn't wait for the worker
+        self.thread = threading.Thread(target=self.run, args=(masterKey,),
+                                       daemon=True)
+        self.thread.start()
+
+    def run(self, masterKey):
+        try:
+            if self.useAgent:
+                vaultKey = agent.getVaultKey(vault.store.path) or False
+            else:
+                vaultKey = vault.unlockVault(masterKey)
+            if vaultKey == False:
+                self.messages.put(('incorrectKey',))
+                return
+            self.messages.put(('unlocked', vaultKey, vault.store.countRows()))
+            for entries, corruptIDs in vault.iterSealedEntries(
+                    vaultKey, self.batchSize):
+                if self.cancelled:
+                    return
+                if corruptIDs:
+                    self.messages.put(('corrupt', corruptIDs))
+                if entries:
+                    self.messages.put(('entries', entries))
+            self.messages.put(('done',))
+        except Exception as error:
+            self.messages.put(('error', error))
+        finally:
+            # only closes the worker's own connection
+            vault.store.close()
+
+    # stop after the current batch; messages already posted are dropped
+    def cancel(self):
+        self.cancelled = True
+
+    # the messages posted since the last poll, without waiting for more;
+    # at most limit entry batches, so applying them fits in one step
+    def poll(self, limit=None):
+        messages = []
+        batches = 0
+        while not self.cancelled and (limit == None or batches < limit):
+            try:
+                message = self.messages.get_nowait()
+            except queue.Empty:
+                break
+            messages.append(message)
+            if message[0] == 'unlocked':
+                self.total = message[2]
+            elif message[0] == 'entries':
+                self.loaded += len(message[1])
+                batches += 1
+            elif message[0] == 'corrupt':
+                self.loaded += len(message[1])
+        return messages
@@ -0,0 +1,849 @@
+import sqlite3
+import base64
+import hmac
+import hashlib
+import os
+import struct
+import threading
+from contextlib import contextmanager
+from Crypto.Cipher import AES
+from Crypto.Random import get_random_bytes
+from Crypto.Util.Padding import pad, unpad
+from profiler import profiler
+import kdf
+
+# known plaintext encrypted under the vault key to verify a master password
+keyCheckText = 'steelpass'
+# first byte of every entry sealed by sealEntry
+rowFormatVersion = 1
+
+def encrypt(key, data):
+    # the key is the vault key, already derived once at unlock
+    # generate a random 16-byte IV
+    iv = get_random_bytes(16)
+    # create the cipher object
+    cipher = AES.new(key, AES.MODE_CBC, iv)
+    # pad the message to be a multiple of AES block size (16 bytes)
+    paddedData = pad(data.encode('utf-8'), AES.block_size)
+    # encrypt the padded message
+    ciphertext = cipher.encrypt(paddedData)
+    # combine the IV and ciphertext and encode them in base64
+    encryptedData = base64.b64encode(iv + ciphertext).decode('utf-8')
+
+    return encryptedData
+
+def decrypt(key, data):
+    try:
+        # decode base64 encoding
+        encryptedData = base64.b64decode(data)
+        # get IV (first 16 bytes) and ciphertext (remaining bytes)
+        iv = encryptedData[:16]
+        ciphertext = encryptedData[16:]
+        # create the cipher object
+        cipher = AES.new(key, AES.MODE_CBC, iv)
+        # decrypt the ciphertext and remove padding
+        decryptedData = unpad(cipher.decrypt(ciphertext), AES.block_size)
+
+        return decryptedData.decode('utf-8')
+    except (ValueError, TypeError):
+        # either the key is invalid or the data is corrupt
+        return False
+
+# decrypt a field written before vaults had their own salt, where every
+# field carried a 16-byte salt and was keyed by a separate PBKDF2 run
+def legacyDecrypt(masterKey, data):
+    try:
+        encryptedData = base64.b64decode(data)
+        salt = encryptedData[:16]
+        key = kdf.deriveKey(masterKey, salt, kdf.legacyParams)
+        # the rest (IV + ciphertext) is laid out like the current format
+        return decrypt(key, base64.b64encode(encryptedData[16:]))
+    except (ValueError, TypeError):
+        return False
+
+# entries are sealed with a sub-key of the vault key, so no key is shared
+# between CBC and GCM
+def getRowKey(vaultKey):
+    return hmac.new(vaultKey, b'steelpass rows', hashlib.sha256).digest()
+
+# all four fields of an entry serialized and sealed as one AES-GCM blob:
+# version byte, 12-byte nonce, ciphertext, 16-byte tag; the version byte is
+# authenticated too
+def sealEntry(vaultKey, title, username, password, seed):
+    data = b''.join(struct.pack('>I', len(field)) + field
+                    for field in [(value or '').encode('utf-8')
+                                  for value in [title, username, password,
+                                                seed]])
+    header = bytes([rowFormatVersion])
+    nonce = get_random_bytes(12)
+    cipher = AES.new(getRowKey(vaultKey), AES.MODE_GCM, nonce=nonce)
+    cipher.update(header)
+    ciphertext, tag = cipher.encrypt_and_digest(data)
+    return header + nonce + ciphertext + tag
+
+# the (title, username, password, seed) of a sealed entry, or False if the
+# key is wrong or the blob was changed in any way
+def openEntry(vaultKey, sealed):
+    if not sealed or sealed[0] != rowFormatVersion:
+        return False
+    cipher = AES.new(getRowKey(vaultKey), AES.MODE_GCM, nonce=sealed[1:13])
+    cipher.update(sealed[:1])
+    try:
+        data = cipher.decrypt_and_verify(sealed[13:-16], sealed[-16:])
+    except ValueError:
+        return False
+    fields = []
+    index = 0
+    while index < len(data):
+        length, = struct.unpack_from('>I', data, index)
+        fields.append(data[index+4:index+4+length].decode('utf-8'))
+        index += 4 + length
+    return tuple(fields)
+
+# a row that does not decrypt under a key that passed the key check has
+# been corrupted or tampered with
+class CorruptEntryError(ValueError):
+    def __init__(self, entryID):
+        super().__init__(f'entry {entryID} failed its integrity check; it '
+                         'has been corrupted or tampered with')
+        self.entryID = entryID
+
+# a vault key that no longer matches the vault, because the master password
+# was changed (by another process) since the key was unlocked
+class StaleKeyError(ValueError):
+    def __init__(self):
+        super().__init__('the master password has changed since the vault '
+                         'was unlocked')
+
+# owns the single SQLite connection that stays open for the app's lifetime
+class VaultStore:
+    # statements are kept as constants so sqlite3's statement cache, which
+    # is keyed by the SQL text, reuses their compiled form on every call
+    # rows written before sealEntry have data NULL and the four fields in
+    # their own base64 CBC columns; newer rows only have data
+    # keyVersion is the version of the vault key a row is sealed under,
+    # which only changes when the master password is (see rotateMasterKey)
+    selectEntriesSQL = '''
+        SELECT id, title, username, password, seed, data, keyVersion
+        FROM entries
+    '''
+    insertEntrySQL = 'INSERT INTO entries (data, keyVersion) VALUES (?, ?)'
+    updateEntrySQL = '''
+        UPDATE entries
+        SET title = NULL, username = NULL, password = NULL, seed = NULL,
+            data = ?, keyVersion = ?
+        WHERE id = ?
+    '''
+    # only reseals a row that nobody changed since it was read
+    rotateEntrySQL = '''
+        UPDATE entries
+        SET title = NULL, username = NULL, password = NULL, seed = NULL,
+            data = ?, keyVersion = ?
+        WHERE id = ? AND data IS ? AND title IS ?
+    '''
+    deleteEntrySQL = 'DELETE FROM entries WHERE id = ?'
+    anyEntrySQL = 'SELECT 1 FROM entries LIMIT 1'
+    selectMetadataSQL = 'SELECT name, value FROM metadata'
+    insertMetadataSQL = '''
+        INSERT OR REPLACE INTO metadata (name, value) VALUES (?, ?)
+    '''
+    insertTokenSQL = 'INSERT INTO blindIndex (token, entryID) VALUES (?, ?)'
+    deleteTokensSQL = 'DELETE FROM blindIndex WHERE entryID = ?'
+
+    def __init__(self, path):
+        self.path = path
+        # an sqlite3 connection only works on the thread that opened it, so
+        # every thread (like the unlock worker) gets its own connection and
+        # transaction depth
+        self.local = threading.local()
+
+    @property
+    def conn(self):
+        return getattr(self.local, 'conn', None)
+
+    @conn.setter
+    def conn(self, conn):
+        self.local.conn = conn
+
+    # depth of nested transaction() scopes
+    @property
+    def depth(self):
+        return getattr(self.local, 'depth', 0)
+
+    @depth.setter
+    def depth(self, depth):
+        self.local.depth = depth
+
+    def connect(self):
+        if self.conn == None:
+            # autocommit mode: transactions only exist inside transaction()
+            self.conn = sqlite3.connect(self.path, isolation_level=None,
+                                        cached_statements=64)
+            # WAL turns each commit into a sequential append, and NORMAL
+            # sync only fsyncs at checkpoints while staying crash-safe
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+            self.conn.execute('PRAGMA temp_store=MEMORY')
+            self.conn.execute('PRAGMA cache_size=-8000') # 8 MB page cache
+        return self.conn
+
+    def close(self):
+        if self.conn != None:
+            self.conn.close()
+            self.conn = None
+
+    # group statements into one atomic commit; scopes can be nested and only
+    # the outermost one commits (or rolls back if anything inside raised)
+    @contextmanager
+    def transaction(self):
+        conn = self.connect()
+        if self.depth == 0:
+            conn.execute('BEGIN IMMEDIATE')
+        self.depth += 1
+        try:
+            yield self
+        except:
+            self.depth -= 1
+            if self.depth == 0:
+                conn.execute('ROLLBACK')
+            raise
+        self.depth -= 1
+        if self.depth == 0:
+            conn.execute('COMMIT')
+
+    @profiler.timed('sqlite.execute')
+    def execute(self, sql, params=()):
+        return self.connect().execute(sql, params)
+
+    @profiler.timed('sqlite.executemany')
+    def executemany(self, sql, rows):
+        return self.connect().executemany(sql, rows)
+
+    # create the tables if they do not already exist
+    def createTables(self):
+        with self.transaction():
+            self.execute('''
+                CREATE TABLE IF NOT EXISTS entries (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    title TEXT,
+                    username TEXT,
+                    password TEXT,
+                    seed TEXT,
+                    data BLOB,
+                    keyVersion INTEGER NOT NULL DEFAULT 0
+                )
+            ''')
+            # tables made before the sealed row format and key versions
+            columns = [row[1] for row in
+                       self.execute('PRAGMA table_info(entries)')]
+            if 'data' not in columns:
+                self.execute('ALTER TABLE entries ADD COLUMN data BLOB')
+            if 'keyVersion' not in columns:
+                self.execute('ALTER TABLE entries ADD COLUMN '
+                             'keyVersion INTEGER NOT NULL DEFAULT 0')
+            self.execute('''
+                CREATE INDEX IF NOT EXISTS entriesKeyVersion
+                ON entries (keyVersion)
+            ''')
+            # vault-level settings: the KDF salt and parameters and the key
+            # check
+            self.execute('''
+                CREATE TABLE IF NOT EXISTS metadata (
+                    name TEXT PRIMARY KEY,
+                    value TEXT
+                )
+            ''')
+            # optional keyed tokens of titles and usernames (see blindToken)
+            self.execute('''
+                CREATE TABLE IF NOT EXISTS blindIndex (
+                    token BLOB NOT NULL,
+                    entryID INTEGER NOT NULL
+                )
+            ''')
+            self.execute('''
+                CREATE INDEX IF NOT EXISTS blindIndexToken
+                ON blindIndex (token)
+            ''')
+            self.execute('''
+                CREATE INDEX IF NOT EXISTS blindIndexEntry
+                ON blindIndex (entryID)
+            ''')
+
+    @profiler.timed('sqlite.getRows')
+    def getRows(self):
+        return self.execute(self.selectEntriesSQL).fetchall()
+
+    # the rows one at a time, as SQLite reads them
+    def iterRows(self):
+        return self.execute(self.selectEntriesSQL)
+
+    # rows that have a blind index token for every one of the given tokens
+    def getRowsByTokens(self, tokens):
+        condition = ' AND '.join(
+            ['id IN (SELECT entryID FROM blindIndex WHERE token = ?)']
+            * len(tokens))
+        return self.execute(f'{self.selectEntriesSQL} WHERE {condition}',
+                            tokens).fetchall()
+
+    def replaceTokens(self, entryID, tokens):
+        with self.transaction():
+            self.execute(self.deleteTokensSQL, (entryID,))
+            self.executemany(self.insertTokenSQL,
+                             [(token, entryID) for token in tokens])
+
+    def countRows(self):
+        return self.execute('SELECT count(*) FROM entries').fetchone()[0]
+
+    def isEmpty(self):
+        return self.execute(self.anyEntrySQL).fetchone() == None
+
+    def insertRow(self, data, keyVersion):
+        with self.transaction():
+            return self.execute(self.insertEntrySQL,
+                                (data, keyVersion)).lastrowid
+
+    def updateRow(self, entryID, data, keyVersion):
+        with self.transaction():
+            self.execute(self.updateEntrySQL, (data, keyVersion, entryID))
+
+    def deleteRow(self, entryID):
+        with self.transaction():
+            self.execute(self.deleteEntrySQL, (entryID,))
+            self.execute(self.deleteTokensSQL, (entryID,))
+
+    def getMetadata(self):
+        return dict(self.execute(self.selectMetadataSQL).fetchall())
+
+    def setMetadata(self, values):
+        with self.transaction():
+            self.executemany(self.insertMetadataSQL, values.items())
+
+store = VaultStore('entries.db')
+
+# create a new database and tables if they do not already exist
+def createDB():
+    store.createTables()
+
+def getMetadata():
+    return store.getMetadata()
+
+# store a new salt, KDF parameters and key check for the given master key
+# and return the derived vault key; without params the KDF is calibrated
+# to take kdf.targetMs on this machine
+def writeVaultHeader(masterKey, params=None):
+    params = params or kdf.calibrate()
+    salt = get_random_bytes(16)
+    vaultKey = kdf.deriveKey(masterKey, salt, params)
+    blindIndex = isBlindIndexEnabled()
+    with store.transaction():
+        store.execute('DELETE FROM metadata')
+        # tokens made with any previous key can never match again; the
+        # caller makes new ones for the rows it writes (see migrateVault)
+        store.execute('DELETE FROM blindIndex')
+        store.setMetadata({
+            'salt': base64.b64encode(salt).decode('utf-8'),
+            **kdf.formatParams(params),
+            'check': encrypt(vaultKey, keyCheckText),
+            # only rows sealed by sealEntry get written from now on
+            'rowFormat': str(rowFormatVersion)
+        })
+        # the index stays on for the rows written under the new key
+        if blindIndex:
+            store.setMetadata({'blindIndex': '1'})
+    return vaultKey
+
+def isVaultEmpty():
+    return store.isEmpty()
+
+# run the KDF once and return the vault key, or False if the master key
+# is incorrect; vaults without entries take the master key as a new one,
+# and vaults from before per-vault salts are migrated in place
+def unlockVault(masterKey):
+    if isVaultEmpty():
+        return writeVaultHeader(masterKey)
+    metadata = getMetadata()
+    if 'nextSalt' in metadata:
+        # mid-rotation either password works, and the key is the new one
+        keys = getRotationKeys(masterKey)
+        return keys[1] if keys else False
+    if 'salt' in metadata:
+        vaultKey = deriveVaultKey(masterKey, metadata)
+        if decrypt(vaultKey, metadata['check']) != keyCheckText:
+            return False
+        if metadata.get('rowFormat') != str(rowFormatVersion):
+            upgradeRows(vaultKey)
+        return vaultKey
+    return migrateVault(masterKey)
+
+# the key derived from the salt and KDF parameters in the metadata, or
+# from the ones of the key being rotated to with prefix 'next'
+def deriveVaultKey(masterKey, metadata, prefix=''):
+    salt = base64.b64decode(metadata[kdf.getFieldName('salt', prefix)])
+    return kdf.deriveKey(masterKey, salt, kdf.getParams(metadata, prefix))
+
+# the version of the vault key a row sealed with vaultKey is under; a key
+# that is neither the current one nor the one being rotated to is out of
+# date, since the master password changed after it was derived
+def getKeyVersion(vaultKey):
+    metadata = getMetadata()
+    if decrypt(vaultKey, metadata['check']) == keyCheckText:
+        return int(metadata.get('keyVersion', 0))
+    if 'nextCheck' in metadata \
+    and decrypt(vaultKey, metadata['nextCheck']) == keyCheckText:
+        return int(metadata['nextKeyVersion'])
+    raise StaleKeyError()
+
+# the keys before and after the rotation in progress, unlocked with either
+# master password, or False if it is neither
+def getRotationKeys(masterKey):
+    metadata = getMetadata()
+    oldKey = deriveVaultKey(masterKey, metadata)
+    if decrypt(oldKey, metadata['check']) == keyCheckText:
+        return oldKey, unwrapKey(oldKey, metadata['nextKey'],
+                                 metadata['nextCheck'])
+    newKey = deriveVaultKey(masterKey, metadata, 'next')
+    if decrypt(newKey, metadata['nextCheck']) == keyCheckText:
+        return unwrapKey(newKey, metadata['previousKey'],
+                         metadata['check']), newKey
+    return False
+
+# keys are wrapped (encrypted) under each other while a rotation runs; an
+# unwrapped key has to pass its own key check too
+def wrapKey(key, wrappedKey):
+    return encrypt(key, base64.b64encode(wrappedKey).decode('utf-8'))
+
+def unwrapKey(key, wrapped, check):
+    unwrapped = decrypt(key, wrapped)
+    if unwrapped == False:
+        return False
+    unwrapped = base64.b64decode(unwrapped)
+    if decrypt(unwrapped, check) != keyCheckText:
+        return False
+    return unwrapped
+
+# vault key -> the other key of the rotation in progress
+otherKeys = {}
+
+# the other key of a rotation in progress, so rows under either key can be
+# read with whichever of them a process holds, or None
+def getOtherKey(vaultKey):
+    if vaultKey in otherKeys:
+        return otherKeys[vaultKey]
+    metadata = getMetadata()
+    if 'nextKey' not in metadata:
+        return None
+    otherKey = unwrapKey(vaultKey, metadata['nextKey'], metadata['nextCheck']) \
+               or unwrapKey(vaultKey, metadata['previousKey'],
+                            metadata['check'])
+    if otherKey == False:
+        return None
+    otherKeys[vaultKey] = otherKey
+    return otherKey
+
+# forget the keys kept by getOtherKey, when the vault locks
+def clearKeys():
+    otherKeys.clear()
+
+# openEntry with the vault key, or with the other key of a rotation
+def openEntryWithKeys(vaultKey, sealed):
+    fields = openEntry(vaultKey, sealed)
+    if fields == False:
+        otherKey = getOtherKey(vaultKey)
+        if otherKey:
+            fields = openEntry(otherKey, sealed)
+    return fields
+
+# the entry (id, title, username, password, seed) of a row in either
+# format, or False if it does not decrypt
+def openRow(vaultKey, row):
+    if row[5] != None:
+        fields = openEntryWithKeys(vaultKey, row[5])
+    else:
+        fields = [decrypt(vaultKey, field) for field in row[1:5]]
+        if False in fields:
+            fields = False
+    if fields == False:
+        return False
+    return (row[0], *fields)
+
+# the (username, password, seed) of a getSealedEntries entry
+@profiler.timed('decrypt.openSealed')
+def openSealed(vaultKey, sealed):
+    if isinstance(sealed, bytes):
+        fields = openEntryWithKeys(vaultKey, sealed)
+        return fields[1:] if fields else ('', '', '')
+    return tuple(decrypt(vaultKey, field) or '' for field in sealed)
+
+# reseal every row still in the four-column CBC format as one GCM blob, in
+# one transaction, then give the freed space back to the file system
+@profiler.timed('vault.upgradeRows')
+def upgradeRows(vaultKey):
+    rows = store.execute(f'{store.selectEntriesSQL} WHERE data IS NULL')
+    keyVersion = getKeyVersion(vaultKey)
+    with store.transaction():
+        store.executemany(store.updateEntrySQL, [
+            (sealEntry(vaultKey, *entry[1:]), keyVersion, entry[0])
+            for entry in [openRow(vaultKey, row) for row in rows.fetchall()]
+            if entry != False
+        ])
+        store.setMetadata({'rowFormat': str(rowFormatVersion)})
+    store.execute('VACUUM')
+
+# decrypt a batch of per-field-salt rows (runs in a worker process)
+def legacyDecryptRows(masterKey, rows):
+    return [(row[0], *[legacyDecrypt(masterKey, field) for field in row[1:5]])
+            for row in rows]
+
+# get all entries written before per-vault salts, in the same shape as
+# getEntries; every field costs a full KDF run, so rows are spread across
+# a process pool with one worker per core
+def getLegacyEntries(masterKey):
+    entries = store.getRows()
+    if not entries:
+        return None
+    # check the first row alone so a wrong key fails after one KDF run
+    if legacyDecrypt(masterKey, entries[0][1]) == False:
+        return False
+    workers = os.cpu_count() or 1
+    if workers == 1 or len(entries) < 2*workers:
+        return legacyDecryptRows(masterKey, entries)
+    # a few batches per worker keeps the cores busy until the end
+    batchSize = -(-len(entries) // (4*workers))
+    batches = [entries[i:i+batchSize]
+               for i in range(0, len(entries), batchSize)]
+    # imported here since it pulls in multiprocessing, which only this rarely
+    # used path needs
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(legacyDecryptRows,
+                               [masterKey]*len(batches), batches)
+        return [entry for batch in results for entry in batch]
+
+# re-encrypt every per-field-salt row under a single vault key
+def migrateVault(masterKey):
+    entries = getLegacyEntries(masterKey)
+    if entries == False:
+        return False
+    # the header and all rows are committed together, so an interrupted
+    # migration leaves the vault in the legacy format
+    with store.transaction():
+        vaultKey = writeVaultHeader(masterKey)
+        store.executemany(store.updateEntrySQL, [
+            (sealEntry(vaultKey, *entry[1:]), 0, entry[0])
+            for entry in entries
+        ])
+        if isBlindIndexEnabled():
+            for entry in entries:
+                store.replaceTokens(entry[0], getBlindTokens(vaultKey,
+                                                             entry[1],
+                                                             entry[2]))
+    return vaultKey
+
+# raise for a row that openRow or openSealedRow could not decrypt: a key
+# the master password was changed under gets the StaleKeyError of
+# getKeyVersion, and otherwise the row itself is bad
+def raiseUnreadable(vaultKey, entryID):
+    getKeyVersion(vaultKey)
+    raise CorruptEntryError(entryID)
+
+# get all entries from table; a row that does not decrypt raises rather
+# than being left out
+@profiler.timed('decrypt.getEntries')
+def getEntries(vaultKey):
+    entries = store.getRows()
+    for i in range(len(entries)):
+        entry = openRow(vaultKey, entries[i])
+        if entry == False:
+            raiseUnreadable(vaultKey, entries[i][0])
+        entries[i] = entry
+    return entries
+
+# a row as (id, title, sealed), where sealed is what openSealed turns into
+# the username, password and seed once an entry is viewed, or False if it
+# does not decrypt; the GCM blob is opened whole to check it, but only the
+# title is kept
+# with withUsername, the username is added as a fourth field, as the search
+# index keeps it (see search.getUsernameKey)
+def openSealedRow(vaultKey, row, withUsername=False):
+    if row[5] != None:
+        fields = openEntryWithKeys(vaultKey, row[5])
+        title = fields[0] if fields else False
+        username = fields[1] if fields else False
+        sealed = row[5]
+    else:
+        title = decrypt(vaultKey, row[1])
+        username = decrypt(vaultKey, row[2]) if withUsername else ''
+        sealed = row[2:5]
+    if title == False or username == False:
+        return False
+    if withUsername:
+        return (row[0], title, sealed,
+                bytearray(username.lower().encode('utf-8')))
+    return (row[0], title, sealed)
+
+# get all entries as openSealedRow entries
+@profiler.timed('decrypt.getSealedEntries')
+def getSealedEntries(vaultKey):
+    entries = store.getRows()
+    for i in range(len(entries)):
+        entry = openSealedRow(vaultKey, entries[i])
+        if entry == False:
+            raiseUnreadable(vaultKey, entries[i][0])
+        entries[i] = entry
+    return entries
+
+# the same entries as getSealedEntries plus their username keys (see
+# openSealedRow), read and decrypted batchSize rows at a time, as (entries,
+# corruptIDs) pairs; the key has passed the key check,
+# so a row that does not decrypt is corrupt, and rather than ending the
+# stream it is left out of entries and its ID goes in corruptIDs
+def iterSealedEntries(vaultKey, batchSize=500):
+    rows = store.iterRows()
+    while True:
+        batch = rows.fetchmany(batchSize)
+        if not batch:
+            return
+        entries = []
+        corruptIDs = []
+        with profiler.span('decrypt.sealedBatch'):
+            for row in batch:
+                entry = openSealedRow(vaultKey, row, True)
+                if entry == False:
+                    corruptIDs.append(row[0])
+                else:
+                    entries.append(entry)
+        yield entries, corruptIDs
+
+# the longest title prefix that gets a blind index token
+blindPrefixLength = 16
+
+# the same text must always give the same token, whatever its spacing or case
+def normalizeText(text):
+    return ' '.join(text.casefold().split())
+
+# a blind index token is a keyed hash of a normalized field, so the database
+# can be searched for an exact title, title prefix or username without being
+# able to tell what the field says; kind keeps the three sets of tokens apart
+def blindToken(vaultKey, kind, text):
+    # a sub-key of the vault key, so the tokens reveal nothing about the key
+    # used for encryption
+    indexKey = hmac.new(vaultKey, b'steelpass blind index',
+                        hashlib.sha256).digest()
+    message = f'{kind}:{normalizeText(text)}'.encode('utf-8')
+    return hmac.new(indexKey, message, hashlib.sha256).digest()[:16]
+
+def getBlindTokens(vaultKey, title, username):
+    title = normalizeText(title)
+    tokens = {blindToken(vaultKey, 'title', title)}
+    for i in range(1, min(len(title), blindPrefixLength)+1):
+        tokens.add(blindToken(vaultKey, 'prefix', title[:i]))
+    if username:
+        tokens.add(blindToken(vaultKey, 'username', username))
+    return tokens
+
+def isBlindIndexEnabled():
+    return getMetadata().get('blindIndex') == '1'
+
+# (re)create the tokens of every entry and turn the blind index on
+def rebuildBlindIndex(vaultKey):
+    entries = getEntries(vaultKey)
+    with store.transaction():
+        store.execute('DELETE FROM blindIndex')
+        for entry in entries:
+            store.replaceTokens(entry[0],
+                                getBlindTokens(vaultKey, entry[1], entry[2]))
+        store.setMetadata({'blindIndex': '1'})
+
+# turn the blind index off and drop its tokens, so lookups scan the vault
+# again and the database no longer says which entries share a title
+def disableBlindIndex():
+    with store.transaction():
+        store.execute('DELETE FROM blindIndex')
+        store.execute("DELETE FROM metadata WHERE name='blindIndex'")
+
+# get the entries whose title is exactly title, whose title starts with
+# titlePrefix and whose username is username (for the criteria given); with
+# the blind index only the matching rows are read and decrypted
+def findEntries(vaultKey, title=None, titlePrefix=None, username=None):
+    # mid-rotation the tokens are under two different keys
+    if not isBlindIndexEnabled() or isRotating():
+        entries = getEntries(vaultKey)
+    else:
+        tokens = []
+        if title != None:
+            tokens.append(blindToken(vaultKey, 'title', title))
+        if titlePrefix:
+            tokens.append(blindToken(vaultKey, 'prefix',
+                normalizeText(titlePrefix)[:blindPrefixLength]))
+        if username != None:
+            tokens.append(blindToken(vaultKey, 'username', username))
+        if not tokens:
+            return getEntries(vaultKey)
+        entries = []
+        for row in store.getRowsByTokens(tokens):
+            entry = openRow(vaultKey, row)
+            if entry == False:
+                raiseUnreadable(vaultKey, row[0])
+            entries.append(entry)
+    # check the decrypted fields, which also covers prefixes longer than
+    # blindPrefixLength and scans without the blind index
+    return [entry for entry in entries
+            if (title == None
+                or normalizeText(entry[1]) == normalizeText(title))
+            and (titlePrefix == None or normalizeText(entry[1]).startswith(
+                normalizeText(titlePrefix)))
+            and (username == None
+                or normalizeText(entry[2]) == normalizeText(username))]
+
+# add entry to table
+def addEntry(title, username, password, seed, vaultKey):
+    with store.transaction():
+        entryID = store.insertRow(sealEntry(vaultKey, title, username,
+                                            password, seed),
+                                  getKeyVersion(vaultKey))
+        if isBlindIndexEnabled():
+            store.replaceTokens(entryID,
+                                getBlindTokens(vaultKey, title, username))
+    return entryID
+
+# update an entry if it has the same title
+def updateEntry(entryID, title, username, password, seed, vaultKey):
+    with store.transaction():
+        store.updateRow(entryID, sealEntry(vaultKey, title, username,
+                                           password, seed),
+                        getKeyVersion(vaultKey))
+        if isBlindIndexEnabled():
+            store.replaceTokens(entryID,
+                                getBlindTokens(vaultKey, title, username))
+
+def deleteEntry(entryID):
+    store.deleteRow(entryID)
+
+def isRotating():
+    return 'nextKey' in getMetadata()
+
+# start changing the master password: derive the new key with a new salt
+# and store its parameters and key check next to the current ones, with
+# each key wrapped under the other so either password unlocks the vault
+# until the rotation finishes; the new key is derived with params, or the
+# current KDF parameters without them; returns (old key, new key), or False
+# if masterKey is not the current master password
+def beginRotation(masterKey, newMasterKey, params=None):
+    metadata = getMetadata()
+    oldKey = deriveVaultKey(masterKey, metadata)
+    if decrypt(oldKey, metadata['check']) != keyCheckText:
+        return False
+    params = params or kdf.getParams(metadata)
+    salt = get_random_bytes(16)
+    newKey = kdf.deriveKey(newMasterKey, salt, params)
+    store.setMetadata({
+        'nextSalt': base64.b64encode(salt).decode('utf-8'),
+        **kdf.formatParams(params, 'next'),
+        'nextCheck': encrypt(newKey, keyCheckText),
+        'nextKeyVersion': str(int(metadata.get('keyVersion', 0)) + 1),
+        'nextKey': wrapKey(oldKey, newKey),
+        'previousKey': wrapKey(newKey, oldKey)
+    })
+    return oldKey, newKey
+
+# reseal a batch of rows from the old key to the new one, with their blind
+# index tokens (runs in a worker process); a row written under the new key
+# while the rotation runs is resealed all the same
+def resealRows(oldKey, newKey, blindIndex, rows):
+    resealed = []
+    for row in rows:
+        if row[5] != None:
+            fields = openEntry(oldKey, row[5]) or openEntry(newKey, row[5])
+        else:
+            fields = [decrypt(oldKey, field) for field in row[1:5]]
+        if fields == False or False in fields:
+            raise CorruptEntryError(row[0])
+        tokens = getBlindTokens(newKey, fields[0], fields[1]) \
+                 if blindIndex else ()
+        resealed.append((row, sealEntry(newKey, *fields), tokens))
+    return resealed
+
+# commit one resealed batch; rows changed by someone else since they were
+# read keep their old version and are picked up again by the next pass
+def writeResealedRows(resealed, keyVersion):
+    with store.transaction():
+        for row, data, tokens in resealed:
+            cursor = store.execute(store.rotateEntrySQL,
+                                   (data, keyVersion, row[0], row[5], row[1]))
+            if cursor.rowcount and tokens:
+                store.replaceTokens(row[0], tokens)
+
+# make the new key the current one and drop the old one; the fields of the
+# old KDF parameters go too, since the new ones may be for another function
+def finishRotation():
+    metadata = getMetadata()
+    params = kdf.getParams(metadata, 'next')
+    stale = kdf.getAllFieldNames() + kdf.getAllFieldNames('next') + [
+        'nextSalt', 'nextCheck', 'nextKeyVersion', 'nextKey', 'previousKey'
+    ]
+    with store.transaction():
+        store.executemany('DELETE FROM metadata WHERE name=?',
+                          [(name,) for name in stale])
+        store.setMetadata({
+            'salt': metadata['nextSalt'],
+            **kdf.formatParams(params),
+            'check': metadata['nextCheck'],
+            'keyVersion': metadata['nextKeyVersion']
+        })
+    clearKeys()
+
+# change the master password, resealing every row under the new key; rows
+# go through a process pool a batch at a time and every batch is committed
+# on its own, so an interrupted rotation loses at most the batches in
+# flight and calling this again (with either password) resumes it;
+# progress(done, total) is called after every batch; params changes the KDF
+# parameters, which with the same password re-tunes the KDF; returns the
+# new vault key, or False if masterKey is wrong
+def rotateMasterKey(masterKey, newMasterKey=None, workers=None,
+                    batchSize=500, progress=None, params=None):
+    if isRotating():
+        keys = getRotationKeys(masterKey)
+    else:
+        keys = beginRotation(masterKey, newMasterKey, params)
+    if keys == False:
+        return False
+    oldKey, newKey = keys
+    keyVersion = int(getMetadata()['nextKeyVersion'])
+    blindIndex = isBlindIndexEnabled()
+    workers = workers or os.cpu_count() or 1
+    selectSQL = f"""
+        {store.selectEntriesSQL} WHERE keyVersion != ? ORDER BY id LIMIT ?
+    """
+    countSQL = 'SELECT count(*) FROM entries WHERE keyVersion != ?'
+    total = store.execute(countSQL, (keyVersion,)).fetchone()[0]
+    done = 0
+    executor = None
+    try:
+        while True:
+            rows = store.execute(selectSQL,
+                                 (keyVersion, batchSize*workers)).fetchall()
+            if not rows:
+                break
+            batches = [rows[i:i+batchSize]
+                       for i in range(0, len(rows), batchSize)]
+            # like getLegacyEntries, the pool only starts when it pays off
+            if executor == None and workers > 1 and len(batches) > 1:
+                from concurrent.futures import ProcessPoolExecutor
+                executor = ProcessPoolExecutor(max_workers=workers)
+            if executor:
+                results = executor.map(resealRows, [oldKey]*len(batches),
+                                       [newKey]*len(batches),
+                                       [blindIndex]*len(batches), batches)
+            else:
+                results = [resealRows(oldKey, newKey, blindIndex, batch)
+                           for batch in batches]
+            for resealed in results:
+                writeResealedRows(resealed, keyVersion)
+                done += len(resealed)
+                if progress:
+                    progress(min(done, total), total)
+    finally:
+        if executor:
+            executor.shutdown()
+    finishRotation()
+    return newKey